@@ -4,25 +4,35 @@ import os
 if os.environ.get("FLASK_ENV") != "production":
     os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for, session
-import tempfile
+from flask import Flask, render_template, request, send_file, flash, redirect, url_for, session, jsonify, g, Response
 from datetime import datetime
 import secrets
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
+import time
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseUpload
-import docx
-import markdown_converter  # Certifique-se de que markdown_converter.py existe na mesma pasta
 
 # Importa seu código original
 from markdown_converter import MarkdownToDocxConverter
+from folder_pipeline import FolderConversionPipeline, FolderTreeWalker, list_folder_files, render_docx, get_process_pool
+from folder_sync import FolderSync, drive_user_id
+from jobs import JobQueue
+from google_drive_integration import (
+    download_drive_file, media_for_upload, execute_upload, is_text_export, decode_exported_text, TEXT_MIME_TYPE
+)
+from conversion_cache import get_conversion_cache, key_for_metadata
+from drive_service import get_drive_service_pool, get_discovery_document
+from docx_templates import get_template
+from formatting_rules import get_profile
+from credential_store import get_credential_store, credentials_to_info
+from upload_conversion import read_uploads, convert_uploads, converted_name, stream_zip
+from drive_scheduler import get_drive_scheduler
+import metrics
+from metrics import span, trace
 import io
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
+# Tamanho máximo do corpo das requisições (uploads de /api/convert)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_BYTES', 200 * 1024 * 1024))
 
 # Configurações do Google Drive
 SCOPES = [
@@ -37,66 +47,145 @@ CLIENT_SECRETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '
 # Instancia seu conversor original
 converter = MarkdownToDocxConverter()
 
-def get_google_drive_service():
-    """Obtém o serviço do Google Drive autenticado"""
-    print("get_google_drive_service: Iniciando obtenção do serviço Google Drive")
-    creds = None
+# Credenciais e serviços do Drive reaproveitados entre requisições deste worker
+drive_services = get_drive_service_pool()
+
+# Credenciais OAuth guardadas no servidor; a sessão guarda só o id (session['credentials_id'])
+credential_store = get_credential_store()
+
+# Fila de jobs de conversão em background
+job_queue = JobQueue()
+
+def use_job_queue(queue):
+    """Troca a fila de jobs usada pelas rotas (o modo ASGI usa uma fila assíncrona)"""
+    global job_queue
+    job_queue = queue
+
+# Token opcional exigido em /metrics (Authorization: Bearer <token>)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Token exigido em /api/convert, para serviços internos (Authorization: Bearer <token>). Sem token, a rota
+# só aceita requisições com CONVERT_API_PUBLIC=1 (conversão anônima liberada de propósito)
+CONVERT_API_TOKEN = os.environ.get('CONVERT_API_TOKEN')
+CONVERT_API_PUBLIC = os.environ.get('CONVERT_API_PUBLIC') == '1'
+
+metrics.register_gauge(
+    'converter_cache', 'Estatísticas do cache de conversões', ('stat',),
+    lambda: {k: v for k, v in get_conversion_cache().stats().items() if isinstance(v, (int, float))}
+)
+metrics.register_gauge(
+    'converter_drive_scheduler', 'Estado do escalonador de chamadas ao Drive', ('stat',),
+    lambda: get_drive_scheduler().stats()
+)
+
+def warm_up():
+    """Importa e carrega de uma vez o que as requisições carregariam sob demanda
+
+    Chamado no processo mestre do gunicorn com preload (veja gunicorn.conf.py): os workers herdam
+    os módulos, o documento de descoberta do Drive, o modelo .docx e o perfil de formatação já prontos.
+    """
+    import google_auth_oauthlib.flow  # noqa: F401 (importação pesada usada só na autenticação)
+    from google.auth.transport.requests import Request  # noqa: F401 (usada na renovação de tokens)
+    get_discovery_document()
+    get_template()
+    get_profile()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def migrate_cookie_credentials():
+    # Sessões antigas traziam as credenciais inteiras no cookie: passa para o armazenamento do servidor
     if 'credentials' in session:
-        print("get_google_drive_service: Credenciais encontradas na sessão")
-        scopes = session['credentials'].get('scopes')
-        print(f"get_google_drive_service: Escopos usados: {scopes}")
-        print(f"get_google_drive_service: Conteúdo das credenciais: {session['credentials']}")
-        creds = Credentials.from_authorized_user_info(session['credentials'], scopes)
-        print(f"get_google_drive_service: creds.valid={creds.valid}, creds.expired={creds.expired}, creds.refresh_token={creds.refresh_token}")
-    else:
+        session['credentials_id'] = credential_store.create(session.pop('credentials'))
+
+@app.after_request
+def record_request_metrics(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        # A regra da rota (ex: /jobs/<job_id>) mantém a cardinalidade dos rótulos baixa
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        metrics.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
+def get_session_credentials():
+    """Obtém as credenciais do Google da sessão, atualizando o token só quando necessário"""
+    session_id = session.get('credentials_id')
+    if not session_id:
         print("get_google_drive_service: Nenhuma credencial na sessão")
-    
-    if not creds or not creds.valid:
-        print("get_google_drive_service: Credenciais inválidas ou ausentes")
-        if creds:
-            if creds.expired:
-                print("get_google_drive_service: Token expirado")
-            if not creds.refresh_token:
-                print("get_google_drive_service: Não há refresh_token disponível")
-        if creds and creds.expired and creds.refresh_token:
-            print("get_google_drive_service: Tentando atualizar o token")
-            creds.refresh(Request())
-            print(f"get_google_drive_service: Após refresh, creds.valid={creds.valid}, creds.expired={creds.expired}")
-        else:
-            print("get_google_drive_service: Não foi possível obter credenciais válidas")
+        return None
+    with span('auth'):
+        info = credential_store.get(session_id)
+        if info is None:
+            print("get_google_drive_service: Sessão expirada ou removida")
+            session.pop('credentials_id', None)
             return None
-    
-    print("get_google_drive_service: Serviço Google Drive criado com sucesso")
-    return build('drive', 'v3', credentials=creds)
+        # O pool do worker reaproveita as credenciais já montadas (e renovadas) deste usuário
+        creds = drive_services.get_credentials(info)
+        if creds is None:
+            credential_store.delete(session_id)
+            session.pop('credentials_id', None)
+        elif creds.token != info.get('token'):
+            credential_store.save_token(session_id, creds)
+        return creds
+
+def is_authenticated():
+    """Indica se a sessão tem credenciais (sem validá-las no armazenamento)"""
+    return 'credentials_id' in session
 
-def extract_text_from_drive_doc(service, file_id):
-    """Extrai texto de um documento do Google Drive"""
+def forget_session_credentials():
+    """Remove as credenciais da sessão atual do armazenamento, do pool do worker e do cookie"""
+    session_id = session.pop('credentials_id', None)
+    if session_id:
+        info = credential_store.get(session_id)
+        if info:
+            drive_services.forget(info)
+        credential_store.delete(session_id)
+
+def get_drive_service_for(creds):
+    """Serviço do Drive da thread atual para as credenciais, medindo a montagem"""
+    with span('service_build'):
+        return drive_services.get_service(creds)
+
+def get_google_drive_service():
+    """Obtém o serviço do Google Drive autenticado"""
+    creds = get_session_credentials()
+    if not creds:
+        return None
+    return get_drive_service_for(creds)
+
+def extract_text_from_drive_doc(service, file_id, file_metadata=None):
+    """Extrai texto de um documento do Google Drive
+
+    Se os metadados (com mimeType) já foram buscados, são reaproveitados em vez de uma nova chamada à API.
+    """
     print(f"extract_text_from_drive_doc: Extraindo texto do arquivo {file_id}")
     try:
-        # Descobre o tipo MIME do arquivo
-        file_metadata = service.files().get(fileId=file_id, fields='mimeType,name').execute()
+        if file_metadata is None or 'mimeType' not in file_metadata:
+            # Descobre o tipo MIME do arquivo
+            with span('metadata'):
+                file_metadata = service.files().get(fileId=file_id, fields='mimeType,name').execute()
         mime_type = file_metadata.get('mimeType')
         print(f"extract_text_from_drive_doc: mimeType do arquivo: {mime_type}")
 
-        if mime_type == 'application/vnd.google-apps.document':
-            # Google Docs: exporta como docx
-            request = service.files().export_media(
-                fileId=file_id,
-                mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            )
-            file_content = request.execute()
-            print("extract_text_from_drive_doc: Download como .docx bem-sucedido (Google Docs)")
-        else:
-            # Outros arquivos (ex: .docx enviado): baixa direto
-            request = service.files().get_media(fileId=file_id)
-            file_content = request.execute()
-            print("extract_text_from_drive_doc: Download direto bem-sucedido (arquivo enviado)")
-
-        with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
-        markdown_text = converter.extract_text_from_docx(temp_file_path)
-        os.unlink(temp_file_path)
+        if is_text_export(mime_type):
+            # Google Docs vêm como texto: sem gerar e reler um .docx
+            with span('download'):
+                file_content = download_drive_file(service, file_id, mime_type, export_as=TEXT_MIME_TYPE)
+            with file_content:
+                with span('extract'):
+                    markdown_text = decode_exported_text(file_content.read())
+            print("extract_text_from_drive_doc: Extração de texto concluída")
+            return markdown_text
+
+        # Outros arquivos (ex: .docx enviado) são baixados direto; Google Docs com GOOGLE_DOC_EXPORT=docx são exportados como .docx
+        with span('download'):
+            file_content = download_drive_file(service, file_id, mime_type)
+        with file_content:
+            print("extract_text_from_drive_doc: Download bem-sucedido")
+            with span('extract'):
+                markdown_text = converter.extract_text_from_docx(file_content)
         print("extract_text_from_drive_doc: Extração de texto concluída")
         return markdown_text
     except HttpError as e:
@@ -108,21 +197,27 @@ def index():
     """Página principal"""
     return render_template('index.html')
 
+def oauth_flow(**kwargs):
+    """Fluxo OAuth do Google; a biblioteca é importada só quando alguém autentica (ou no warm_up)"""
+    from google_auth_oauthlib.flow import Flow
+    return Flow.from_client_secrets_file(
+        CLIENT_SECRETS_FILE,
+        scopes=SCOPES,
+        redirect_uri=url_for('oauth_callback', _external=True),
+        **kwargs
+    )
+
 @app.route('/auth')
 def auth():
     """Inicia o processo de autenticação do Google"""
     print("auth: Iniciando autenticação OAuth")
-    session.pop('credentials', None)
+    forget_session_credentials()
     session.pop('state', None)
     if not os.path.exists(CLIENT_SECRETS_FILE):
         print("auth: CLIENT_SECRETS_FILE não encontrado")
         flash('Arquivo de credenciais do Google não encontrado. Configure as credenciais primeiro.', 'error')
         return redirect(url_for('index'))
-    flow = Flow.from_client_secrets_file(
-        CLIENT_SECRETS_FILE,
-        scopes=SCOPES,
-        redirect_uri=url_for('oauth_callback', _external=True)
-    )
+    flow = oauth_flow()
     authorization_url, state = flow.authorization_url(
         access_type='offline',
         include_granted_scopes='true',
@@ -137,39 +232,149 @@ def oauth_callback():
     """Callback da autenticação OAuth"""
     print("oauth_callback: Callback recebido")
     try:
-        flow = Flow.from_client_secrets_file(
-            CLIENT_SECRETS_FILE,
-            scopes=SCOPES,
-            state=session.get('state'),
-            redirect_uri=url_for('oauth_callback', _external=True)
-        )
+        flow = oauth_flow(state=session.get('state'))
         print("oauth_callback: Buscando token OAuth")
         flow.fetch_token(authorization_response=request.url)
         credentials = flow.credentials
         print(f"oauth_callback: Token recebido, escopos: {credentials.scopes}")
-        session['credentials'] = {
-            'token': credentials.token,
-            'refresh_token': credentials.refresh_token,
-            'token_uri': credentials.token_uri,
-            'client_id': credentials.client_id,
-            'client_secret': credentials.client_secret,
-            'scopes': credentials.scopes
-        }
+        forget_session_credentials()
+        session['credentials_id'] = credential_store.create(credentials_to_info(credentials))
         flash('Autenticação realizada com sucesso!', 'success')
         print("oauth_callback: Autenticação realizada com sucesso")
         return redirect(url_for('index'))
     except Exception as e:
         print(f"oauth_callback: Erro na autenticação: {str(e)}")
-        session.pop('credentials', None)
+        forget_session_credentials()
         session.pop('state', None)
         flash(f'Erro na autenticação: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+def describe_http_error(e):
+    """Traduz um HttpError do Google Drive em uma mensagem para o usuário"""
+    if e.resp.status == 404:
+        return 'Arquivo não encontrado. Verifique se o ID está correto e se você tem acesso ao arquivo.'
+    if e.resp.status == 403:
+        return 'Acesso negado. Verifique se você tem permissão para acessar este arquivo.'
+    return f'Erro do Google Drive: {str(e)}'
+
+def get_job_owner():
+    """Identificador do dono dos jobs desta sessão"""
+    if 'job_owner' not in session:
+        session['job_owner'] = secrets.token_hex(16)
+    return session['job_owner']
+
+def run_convert_job(job, creds, file_id):
+    """Converte um documento do Google Drive e envia para o Drive do usuário (executa em background)"""
+    with trace('convert', job=job.id, file=file_id) as record:
+        result = convert_drive_file(job, creds, file_id)
+        record['status'] = result['status']
+        metrics.FILES.inc(kind='convert', status=result['status'])
+        job.file_done(result)
+
+def convert_drive_file(job, creds, file_id):
+    """Etapas da conversão de um documento; devolve o resultado no formato de job.file_done"""
+    job.set_files([{'id': file_id, 'name': file_id}])
+    stage = 'metadata'
+    filename = None
+    try:
+        service = get_drive_service_for(creds)
+        with span('metadata'):
+            file_metadata = service.files().get(fileId=file_id, fields='id,name,mimeType,md5Checksum,modifiedTime').execute()
+        filename = file_metadata.get('name', 'documento')
+        print(f"convert: Nome do arquivo: {filename}")
+        stage = 'convert'
+        # Documentos inalterados desde a última conversão vêm do cache
+        cache = get_conversion_cache()
+        cache_key = key_for_metadata(file_metadata)
+        doc_data = cache.get(cache_key)
+        if doc_data is not None:
+            print("convert: Documento encontrado no cache de conversões")
+        else:
+            markdown_text = extract_text_from_drive_doc(service, file_id, file_metadata)
+            # Documentos muito grandes são montados em pedaços no pool de processos (backend stream)
+            doc_data = render_docx(converter, markdown_text, get_process_pool())
+            cache.put(cache_key, doc_data)
+        output_filename = f"{filename}_formatado_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
+        print(f"convert: Enviando arquivo {output_filename} para o Google Drive")
+        stage = 'upload'
+
+        # Faz upload para o Google Drive direto do buffer em memória (em pedaços retomáveis se for grande)
+        media = media_for_upload(io.BytesIO(doc_data))
+        with span('upload'):
+            uploaded = execute_upload(service.files().create(
+                body={
+                    'name': output_filename,
+                    'mimeType': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+                },
+                media_body=media,
+                fields='id,webViewLink'
+            ))
+    except HttpError as e:
+        print(f"convert: HttpError {e.resp.status} - {e}")
+        return {'id': file_id, 'name': filename, 'status': 'error', 'stage': stage, 'error': describe_http_error(e)}
+    except Exception as e:
+        print(f"convert: Erro durante a conversão: {str(e)}")
+        return {'id': file_id, 'name': filename, 'status': 'error', 'stage': stage, 'error': f'Erro durante a conversão: {str(e)}'}
+
+    file_link = uploaded.get('webViewLink')
+    print(f"convert: Arquivo enviado para o Drive: {file_link}")
+    return {'id': file_id, 'name': filename, 'status': 'ok', 'stage': stage, 'link': file_link}
+
+def run_convert_folder_job(job, creds, folder_id):
+    """Converte todos os arquivos de uma pasta do Google Drive (executa em background)"""
+    service = get_drive_service_for(creds)
+    # Busca todos os arquivos .docx e Google Docs na pasta
+    with span('list'):
+        files = list_folder_files(service, folder_id)
+    print(f"convert_folder: {len(files)} arquivos encontrados para conversão.")
+    job.set_files(files)
+    if not files:
+        return
+
+    # Processa os arquivos em paralelo (download, conversão e upload)
+    pipeline = FolderConversionPipeline(lambda: drive_services.get_service(creds))
+    pipeline.run(files, folder_id, on_result=job.file_done)
+
+def run_convert_tree_job(job, creds, folder_id):
+    """Converte os arquivos da pasta e de todas as subpastas, com cada saída na pasta do arquivo (executa em background)
+
+    A conversão começa assim que as primeiras páginas da listagem chegam; o total do job cresce durante a listagem.
+    """
+    walker = FolderTreeWalker(lambda: drive_services.get_service(creds), folder_id)
+
+    def discovered():
+        for files in walker.batches():
+            job.set_files(files)
+            yield from files
+
+    pipeline = FolderConversionPipeline(lambda: drive_services.get_service(creds))
+    results = pipeline.run(discovered(), folder_id, on_result=job.file_done)
+    print(f"convert_folder: {len(results)} arquivos processados na árvore de pastas.")
+    if walker.errors:
+        raise RuntimeError(f"Não foi possível listar {len(walker.errors)} pasta(s): " + '; '.join(walker.errors[:5]))
+
+def run_sync_folder_job(job, creds, folder_id):
+    """Sincroniza uma pasta: converte só arquivos novos ou alterados e atualiza as saídas existentes"""
+    service = get_drive_service_for(creds)
+    # O page token é do usuário do Drive (não da sessão nem do login): a próxima sincronização da pasta o encontra
+    sync = FolderSync(service, folder_id, state_key=f'{drive_user_id(service)}:{folder_id}')
+    with span('list'):
+        files = sync.plan()
+    print(f"convert_folder: {len(files)} arquivos novos ou alterados para sincronizar.")
+    job.set_files(files)
+    results = []
+    if files:
+        pipeline = FolderConversionPipeline(lambda: drive_services.get_service(creds))
+        results = pipeline.run(files, folder_id, on_result=job.file_done)
+    # Com falhas, mantém o token antigo para que a próxima sincronização tente esses arquivos de novo
+    if all(r['status'] == 'ok' for r in results):
+        sync.commit()
+
 @app.route('/convert', methods=['POST'])
 def convert():
-    """Converte o documento do Google Drive e envia para o Drive do usuário"""
+    """Enfileira a conversão de um documento do Google Drive"""
     print("convert: Iniciando conversão")
-    if 'credentials' not in session:
+    if not is_authenticated():
         print("convert: Usuário não autenticado")
         flash('Você precisa se autenticar primeiro.', 'error')
         return redirect(url_for('index'))
@@ -180,64 +385,26 @@ def convert():
         flash('Por favor, forneça um ID de arquivo válido.', 'error')
         return redirect(url_for('index'))
     try:
-        service = get_google_drive_service()
-        if not service:
+        creds = get_session_credentials()
+        if not creds:
             print("convert: Erro ao obter serviço Google Drive")
             flash('Erro na autenticação. Tente novamente.', 'error')
             return redirect(url_for('auth'))
-        file_metadata = service.files().get(fileId=file_id).execute()
-        filename = file_metadata.get('name', 'documento')
-        print(f"convert: Nome do arquivo: {filename}")
-        markdown_text = extract_text_from_drive_doc(service, file_id)
-        doc_bytes = converter.parse_markdown_to_docx(markdown_text, '', None)
-        output_filename = f"{filename}_formatado_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
-        print(f"convert: Enviando arquivo {output_filename} para o Google Drive")
-
-        # Salva o arquivo temporariamente para upload e lê para memória
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as temp_file:
-            temp_file.write(doc_bytes.read())
-            temp_file_path = temp_file.name
-
-        # Lê o conteúdo do arquivo para memória e fecha o arquivo
-        with open(temp_file_path, 'rb') as f:
-            file_data = f.read()
-        os.unlink(temp_file_path)
-
-        # Faz upload para o Google Drive a partir da memória
-        media = MediaIoBaseUpload(io.BytesIO(file_data), mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document', resumable=False)
-        uploaded = service.files().create(
-            body={
-                'name': output_filename,
-                'mimeType': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            },
-            media_body=media,
-            fields='id,webViewLink'
-        ).execute()
-
-        file_link = uploaded.get('webViewLink')
-        print(f"convert: Arquivo enviado para o Drive: {file_link}")
-
-        flash(f'Arquivo convertido enviado para seu Google Drive! <a href="{file_link}" target="_blank">Abrir no Drive</a>', 'success')
-        return redirect(url_for('index'))
-    except HttpError as e:
-        print(f"convert: HttpError {e.resp.status} - {e}")
-        if e.resp.status == 404:
-            flash('Arquivo não encontrado. Verifique se o ID está correto e se você tem acesso ao arquivo.', 'error')
-        elif e.resp.status == 403:
-            flash('Acesso negado. Verifique se você tem permissão para acessar este arquivo.', 'error')
-        else:
-            flash(f'Erro do Google Drive: {str(e)}', 'error')
+        job_id = job_queue.submit('convert', get_job_owner(), run_convert_job, creds, file_id, params={'file_id': file_id})
+        session['last_job_id'] = job_id
+        print(f"convert: Job {job_id} enfileirado")
+        flash('Conversão iniciada. O progresso aparece abaixo.', 'info')
         return redirect(url_for('index'))
     except Exception as e:
-        print(f"convert: Erro durante a conversão: {str(e)}")
+        print(f"convert: Erro ao iniciar a conversão: {str(e)}")
         flash(f'Erro durante a conversão: {str(e)}', 'error')
         return redirect(url_for('index'))
 
 @app.route('/convert_folder', methods=['POST'])
 def convert_folder():
-    """Converte todos os arquivos .docx e Google Docs de uma pasta do Google Drive e faz upload dos convertidos na mesma pasta"""
+    """Enfileira a conversão de todos os arquivos .docx e Google Docs de uma pasta do Google Drive, com upload dos convertidos na mesma pasta"""
     print("convert_folder: Iniciando conversão em lote")
-    if 'credentials' not in session:
+    if not is_authenticated():
         print("convert_folder: Usuário não autenticado")
         flash('Você precisa se autenticar primeiro.', 'error')
         return redirect(url_for('index'))
@@ -248,104 +415,90 @@ def convert_folder():
         flash('Por favor, forneça um ID de pasta válido.', 'error')
         return redirect(url_for('index'))
     try:
-        service = get_google_drive_service()
-        if not service:
+        creds = get_session_credentials()
+        if not creds:
             print("convert_folder: Erro ao obter serviço Google Drive")
             flash('Erro na autenticação. Tente novamente.', 'error')
             return redirect(url_for('auth'))
-
-        # Busca todos os arquivos .docx e Google Docs na pasta
-        query = (
-            f"('{folder_id}' in parents) and "
-            "("
-            "mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document' or "
-            "mimeType='application/vnd.google-apps.document'"
-            ") and trashed=false"
-        )
-        files = []
-        page_token = None
-        while True:
-            response = service.files().list(
-                q=query,
-                spaces='drive',
-                fields='nextPageToken, files(id, name, mimeType)',
-                pageToken=page_token
-            ).execute()
-            files.extend(response.get('files', []))
-            page_token = response.get('nextPageToken', None)
-            if page_token is None:
-                break
-
-        if not files:
-            flash('Nenhum arquivo .docx ou Google Docs encontrado na pasta.', 'warning')
-            return redirect(url_for('index'))
-
-        print(f"convert_folder: {len(files)} arquivos encontrados para conversão.")
-
-        # Processa cada arquivo
-        for file in files:
-            file_id = file['id']
-            filename = file['name']
-            mime_type = file.get('mimeType')
-            print(f"convert_folder: Processando {filename} ({file_id}) tipo {mime_type}")
-
-            # Download conforme o tipo
-            if mime_type == 'application/vnd.google-apps.document':
-                # Google Docs: exporta como docx
-                request = service.files().export_media(
-                    fileId=file_id,
-                    mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-                )
-                file_content = request.execute()
-            else:
-                # .docx enviado: baixa direto
-                request = service.files().get_media(fileId=file_id)
-                file_content = request.execute()
-
-            with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
-            # Extrai markdown e converte
-            markdown_text = converter.extract_text_from_docx(temp_file_path)
-            doc_bytes = converter.parse_markdown_to_docx(markdown_text, '', None)
-            output_filename = f"{os.path.splitext(filename)[0]}_formatado_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
-            # Salva convertido temporariamente
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as temp_out:
-                temp_out.write(doc_bytes.read())
-                temp_out_path = temp_out.name
-            # Upload para a mesma pasta
-            with open(temp_out_path, 'rb') as f:
-                file_data = f.read()
-            media = MediaIoBaseUpload(io.BytesIO(file_data), mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document', resumable=False)
-            uploaded = service.files().create(
-                body={
-                    'name': output_filename,
-                    'mimeType': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                    'parents': [folder_id]
-                },
-                media_body=media,
-                fields='id,webViewLink'
-            ).execute()
-            print(f"convert_folder: Arquivo convertido enviado: {uploaded.get('webViewLink')}")
-            os.unlink(temp_file_path)
-            os.unlink(temp_out_path)
-
-        flash(f'{len(files)} arquivos convertidos e enviados para a mesma pasta no Google Drive!', 'success')
-        return redirect(url_for('index'))
-    except HttpError as e:
-        print(f"convert_folder: HttpError {e.resp.status} - {e}")
-        flash(f'Erro do Google Drive: {str(e)}', 'error')
+        owner = get_job_owner()
+        if request.form.get('sync') in ('1', 'on', 'true'):
+            # Modo de sincronização: só arquivos novos ou alterados, atualizando as saídas no lugar
+            job_id = job_queue.submit('sync_folder', owner, run_sync_folder_job, creds, folder_id, params={'folder_id': folder_id})
+        elif request.form.get('recursive') in ('1', 'on', 'true'):
+            # Pasta e todas as subpastas, com as saídas espelhadas em cada subpasta
+            job_id = job_queue.submit('convert_tree', owner, run_convert_tree_job, creds, folder_id, params={'folder_id': folder_id, 'recursive': True})
+        else:
+            job_id = job_queue.submit('convert_folder', owner, run_convert_folder_job, creds, folder_id, params={'folder_id': folder_id})
+        session['last_job_id'] = job_id
+        print(f"convert_folder: Job {job_id} enfileirado")
+        flash('Conversão em lote iniciada. O progresso aparece abaixo.', 'info')
         return redirect(url_for('index'))
     except Exception as e:
-        print(f"convert_folder: Erro durante a conversão em lote: {str(e)}")
+        print(f"convert_folder: Erro ao iniciar a conversão em lote: {str(e)}")
         flash(f'Erro durante a conversão em lote: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+@app.route('/api/convert', methods=['POST'])
+def api_convert():
+    """Converte .docx ou markdown enviados na requisição e devolve o .docx formatado, sem passar pelo Drive
+
+    Aceita arquivos em multipart (um ou vários) ou o documento no corpo da requisição (?name= define o nome).
+    Vários arquivos, ou ?format=zip, são devolvidos num zip gerado em streaming.
+    """
+    if CONVERT_API_TOKEN:
+        if request.headers.get('Authorization') != f'Bearer {CONVERT_API_TOKEN}':
+            return jsonify({'error': 'Não autorizado'}), 401
+    elif not CONVERT_API_PUBLIC:
+        return jsonify({'error': 'API desativada: defina CONVERT_API_TOKEN ou CONVERT_API_PUBLIC=1'}), 403
+    uploads = read_uploads(request)
+    if not uploads:
+        return jsonify({'error': 'Envie um arquivo .docx ou markdown'}), 400
+    print(f"api_convert: {len(uploads)} arquivos recebidos")
+    if len(uploads) == 1 and request.args.get('format') != 'zip':
+        upload, doc_data, error = next(convert_uploads(uploads))
+        if error:
+            return jsonify({'error': f'Erro durante a conversão: {error}'}), 422
+        return send_file(
+            io.BytesIO(doc_data),
+            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+            as_attachment=True,
+            download_name=converted_name(upload['name'])
+        )
+    return Response(
+        stream_zip(uploads),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename="documentos_formatados.zip"'}
+    )
+
+@app.route('/jobs')
+def list_jobs():
+    """Lista os jobs recentes da sessão"""
+    return jsonify(job_queue.store.list_jobs(get_job_owner()))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Progresso, ETA e resultados por arquivo de um job"""
+    job = job_queue.store.get_job(job_id, owner=get_job_owner())
+    if job is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(job)
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Contadores do cache de conversões"""
+    return jsonify(get_conversion_cache().stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas do worker no formato de exposição do Prometheus"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response('Não autorizado\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/logout')
 def logout():
     """Remove as credenciais da sessão"""
-    if 'credentials' in session:
-        del session['credentials']
+    forget_session_credentials()
     flash('Logout realizado com sucesso.', 'info')
     return redirect(url_for('index'))
 
@@ -0,0 +1,170 @@
+# Modo ASGI do conversor: uvicorn asgi:app
+#
+# As rotas são as mesmas do app Flask (sessão, OAuth e templates continuam no Flask, atendido em threads),
+# mas os jobs de conversão rodam como corrotinas no loop do servidor: o I/O com o Drive é assíncrono e só
+# a extração e a montagem do .docx vão para o pool de processos limitado. Assim uma instância mantém
+# centenas de conversões em andamento em vez de JOB_WORKERS.
+import io
+import os
+import asyncio
+import tempfile
+
+from a2wsgi import WSGIMiddleware
+from googleapiclient.errors import HttpError
+
+import app as flask_app
+from jobs import AsyncJobQueue
+from async_drive import AsyncDriveClient, close_http_client
+from conversion_cache import get_conversion_cache, key_for_content, key_for_metadata
+from folder_pipeline import (
+    FOLDER_FILE_FIELDS, MAX_IN_FLIGHT, folder_files_query, converter_for, get_process_pool, output_name
+)
+from folder_sync import output_properties
+from google_drive_integration import DOCX_MIME_TYPE, SPOOL_MAX_BYTES, export_mime_type
+import metrics
+from metrics import span, trace, record_spans
+
+# Threads que atendem as rotas do Flask (páginas, OAuth, criação de jobs); os jobs em si rodam no loop
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 16))
+
+
+async def run_in_process_pool(func, *args):
+    """Trabalho de CPU no pool de processos limitado, sem bloquear o loop"""
+    return await asyncio.wrap_future(get_process_pool().submit(func, *args))
+
+
+async def download_content(drive, file):
+    """Conteúdo do arquivo como bytes ou, acima de SPOOL_MAX_BYTES, caminho de um arquivo temporário"""
+    export_as = export_mime_type(file.get('mimeType'))
+    if int(file.get('size') or 0) > SPOOL_MAX_BYTES:
+        with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as temp_file:
+            try:
+                await drive.download(file['id'], file.get('mimeType'), fh=temp_file, export_as=export_as)
+            except BaseException:
+                temp_file.close()
+                os.unlink(temp_file.name)
+                raise
+        return temp_file.name
+    buffer = await drive.download(file['id'], file.get('mimeType'), fh=io.BytesIO(), export_as=export_as)
+    return buffer.getvalue()
+
+
+async def convert_file_job(job, creds, file_id):
+    """Versão assíncrona de app.run_convert_job"""
+    with trace('convert', job=job.id, file=file_id, mode='asgi') as record:
+        result = await convert_drive_file(job, creds, file_id)
+        record['status'] = result['status']
+        metrics.FILES.inc(kind='convert', status=result['status'])
+        await asyncio.to_thread(job.file_done, result)
+
+
+async def convert_drive_file(job, creds, file_id):
+    await asyncio.to_thread(job.set_files, [{'id': file_id, 'name': file_id}])
+    stage = 'metadata'
+    filename = None
+    try:
+        drive = AsyncDriveClient(creds)
+        with span('metadata'):
+            file_metadata = await drive.get(file_id, 'id,name,mimeType,size,md5Checksum,modifiedTime')
+        filename = file_metadata.get('name', 'documento')
+        stage = 'convert'
+        cache = get_conversion_cache()
+        cache_key = key_for_metadata(file_metadata)
+        doc_data = await asyncio.to_thread(cache.get, cache_key)
+        if doc_data is None:
+            with span('download'):
+                file_content = await download_content(drive, file_metadata)
+            doc_data, spans = await run_in_process_pool(converter_for(file_metadata), file_content)
+            record_spans(spans)
+            await asyncio.to_thread(cache.put, cache_key, doc_data)
+        stage = 'upload'
+        with span('upload'):
+            uploaded = await drive.upload(
+                {'name': output_name({'name': filename}), 'mimeType': DOCX_MIME_TYPE}, doc_data
+            )
+    except HttpError as e:
+        print(f"convert: HttpError {e.resp.status} - {e}")
+        return {'id': file_id, 'name': filename, 'status': 'error', 'stage': stage, 'error': flask_app.describe_http_error(e)}
+    except Exception as e:
+        print(f"convert: Erro durante a conversão: {str(e)}")
+        return {'id': file_id, 'name': filename, 'status': 'error', 'stage': stage, 'error': f'Erro durante a conversão: {str(e)}'}
+    print(f"convert: Arquivo enviado para o Drive: {uploaded.get('webViewLink')}")
+    return {'id': file_id, 'name': filename, 'status': 'ok', 'stage': stage, 'link': uploaded.get('webViewLink')}
+
+
+async def convert_folder_job(job, creds, folder_id):
+    """Versão assíncrona de app.run_convert_folder_job: todos os arquivos da pasta em andamento ao mesmo tempo"""
+    drive = AsyncDriveClient(creds)
+    with span('list'):
+        files = await drive.list_files(folder_files_query(folder_id), FOLDER_FILE_FIELDS)
+    print(f"convert_folder: {len(files)} arquivos encontrados para conversão.")
+    await asyncio.to_thread(job.set_files, files)
+    # Limita quantos arquivos ficam em memória entre download e upload
+    in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+    cache = get_conversion_cache()
+
+    async def process(file):
+        async with in_flight:
+            stage = 'download'
+            try:
+                if (file.get('capabilities') or {}).get('canDownload') is False:
+                    raise PermissionError('Sem permissão para baixar o arquivo')
+                metadata_key = key_for_metadata(file)
+                doc_data = await asyncio.to_thread(cache.get, metadata_key)
+                if doc_data is None:
+                    with span('download'):
+                        file_content = await download_content(drive, file)
+                    cache_keys = [metadata_key] if metadata_key else []
+                    if isinstance(file_content, bytes):
+                        content_key = key_for_content(file_content)
+                        doc_data = await asyncio.to_thread(cache.get, content_key)
+                        cache_keys.append(content_key)
+                    if doc_data is None:
+                        stage = 'convert'
+                        doc_data, spans = await run_in_process_pool(converter_for(file), file_content)
+                        record_spans(spans)
+                    for key in cache_keys:
+                        await asyncio.to_thread(cache.put, key, doc_data)
+                stage = 'upload'
+                metadata = {'appProperties': output_properties(file)}
+                if not file.get('output_id'):
+                    metadata.update({'name': output_name(file), 'mimeType': DOCX_MIME_TYPE, 'parents': [file.get('folder_id') or folder_id]})
+                with span('upload'):
+                    uploaded = await drive.upload(metadata, doc_data, file_id=file.get('output_id'))
+                result = {'id': file['id'], 'name': file['name'], 'status': 'ok', 'stage': stage,
+                          'link': uploaded.get('webViewLink'), 'error': None}
+            except Exception as e:
+                print(f"convert_folder: Falha em {file['name']} ({file['id']}) na etapa {stage}: {e}")
+                result = {'id': file['id'], 'name': file['name'], 'status': 'error', 'stage': stage,
+                          'link': None, 'error': str(e)}
+            metrics.FILES.inc(kind='folder', status=result['status'])
+            await asyncio.to_thread(job.file_done, result)
+            return result
+
+    return await asyncio.gather(*(process(file) for file in files))
+
+
+job_queue = AsyncJobQueue(handlers={
+    'convert': convert_file_job,
+    'convert_folder': convert_folder_job,
+    # sync_folder (Changes API) e convert_tree (listagem recursiva) usam o cliente síncrono e rodam numa thread
+})
+flask_app.use_job_queue(job_queue)
+# Cada requisição WSGI roda no pool de WSGI_THREADS threads, com o corpo lido em stream do loop
+wsgi_app = WSGIMiddleware(flask_app.app, workers=WSGI_THREADS)
+
+
+async def app(scope, receive, send):
+    """Aplicação ASGI: lifespan inicia a fila de jobs no loop do servidor; HTTP vai para o app Flask"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                job_queue.start(asyncio.get_running_loop())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_http_client()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    elif scope['type'] == 'http':
+        await wsgi_app(scope, receive, send)
@@ -0,0 +1,279 @@
+import os
+import json
+import uuid
+import asyncio
+import weakref
+import tempfile
+
+import httpx
+import httplib2
+from googleapiclient.errors import HttpError
+from google.auth.transport.requests import Request
+
+from google_drive_integration import (
+    DOCX_MIME_TYPE, GOOGLE_DOC_MIME_TYPE, DRIVE_CHUNK_SIZE, RESUMABLE_THRESHOLD, SPOOL_MAX_BYTES
+)
+from drive_scheduler import (
+    get_drive_scheduler, is_throttled, retry_after_seconds, backoff_delay, RETRY_STATUS, DRIVE_MAX_RETRIES
+)
+from drive_service import DRIVE_HTTP_TIMEOUT, credentials_key
+from metrics import BYTES
+
+DRIVE_API = 'https://www.googleapis.com/drive/v3'
+DRIVE_UPLOAD_API = 'https://www.googleapis.com/upload/drive/v3'
+
+# Conexões HTTP abertas pelo loop; a vez de cada requisição é decidida pelo escalonador do processo
+ASYNC_DRIVE_CONCURRENCY = int(os.environ.get('ASYNC_DRIVE_CONCURRENCY', 64))
+
+_http_client = None
+_refresh_locks = weakref.WeakKeyDictionary()
+
+
+def get_http_client():
+    """Cliente HTTP assíncrono compartilhado (deve ser usado sempre no mesmo loop)"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=DRIVE_HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=ASYNC_DRIVE_CONCURRENCY, max_keepalive_connections=ASYNC_DRIVE_CONCURRENCY),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def _http_error(status, content, uri):
+    # Mesmo tipo de erro do cliente síncrono: describe_http_error e is_transient_error continuam valendo
+    return HttpError(httplib2.Response({'status': status}), content, uri=uri)
+
+
+class AsyncDriveClient:
+    """Chamadas ao Drive v3 com httpx no loop de eventos, para o modo ASGI
+
+    Cada requisição passa pelo mesmo escalonador (e com a mesma chave de usuário) do transporte do modo
+    síncrono; limitações (429, 403 de quota) e erros 5xx são repetidos com backoff, respeitando Retry-After.
+    """
+
+    def __init__(self, creds):
+        self.creds = creds
+        self.http = get_http_client()
+        self.user = credentials_key(creds)
+        self.scheduler = get_drive_scheduler()
+
+    async def _token(self, force_refresh=False):
+        if self.creds.valid and not force_refresh:
+            return self.creds.token
+        lock = _refresh_locks.setdefault(self.creds, asyncio.Lock())
+        async with lock:
+            if force_refresh or not self.creds.valid:
+                # google-auth é síncrono: a renovação roda numa thread
+                token = self.creds.token
+                await asyncio.to_thread(self._refresh_if_unchanged, token)
+        return self.creds.token
+
+    def _refresh_if_unchanged(self, token):
+        if self.creds.token == token:
+            self.creds.refresh(Request())
+
+    async def _send(self, method, url, **kwargs):
+        """Envia a requisição com novas tentativas; devolve a resposta de sucesso ou levanta HttpError"""
+        headers = dict(kwargs.pop('headers', None) or {})
+        refreshed = False
+        attempt = 0
+        while True:
+            headers['Authorization'] = f'Bearer {await self._token()}'
+            try:
+                response = await self._request(method, url, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                if attempt >= DRIVE_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                attempt += 1
+                print(f"async_drive: {method} {url} falhou ({e}); nova tentativa {attempt} em {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            status = response.status_code
+            if status == 401 and not refreshed:
+                refreshed = True
+                await self._token(force_refresh=True)
+                continue
+            throttled = is_throttled(status, response.content)
+            if (throttled or status in RETRY_STATUS) and attempt < DRIVE_MAX_RETRIES:
+                delay = max(retry_after_seconds(response.headers) if throttled else 0.0, backoff_delay(attempt))
+                attempt += 1
+                print(f"async_drive: {method} {url} retornou {status}; nova tentativa {attempt} em {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            if status >= 400:
+                raise _http_error(status, response.content, str(response.url))
+            return response
+
+    async def _request(self, method, url, **kwargs):
+        """Uma requisição, com a vaga reservada no escalonador e o resultado informado a ele"""
+        await self.scheduler.acquire_async(self.user)
+        try:
+            response = await self.http.request(method, url, **kwargs)
+        except BaseException:
+            self.scheduler.release(self.user)
+            raise
+        throttled = is_throttled(response.status_code, response.content)
+        self.scheduler.release(self.user, throttled, retry_after_seconds(response.headers) if throttled else 0.0)
+        return response
+
+    async def get(self, file_id, fields):
+        response = await self._send('GET', f'{DRIVE_API}/files/{file_id}', params={'fields': fields})
+        return response.json()
+
+    async def list_files(self, query, fields):
+        """Todos os arquivos da consulta, paginando com pageSize 1000"""
+        files = []
+        page_token = None
+        while True:
+            params = {'q': query, 'spaces': 'drive', 'fields': f'nextPageToken, files({fields})', 'pageSize': 1000}
+            if page_token:
+                params['pageToken'] = page_token
+            response = (await self._send('GET', f'{DRIVE_API}/files', params=params)).json()
+            files.extend(response.get('files', []))
+            page_token = response.get('nextPageToken')
+            if page_token is None:
+                return files
+
+    async def download(self, file_id, mime_type=None, fh=None, export_as=DOCX_MIME_TYPE):
+        """Baixa o arquivo em streaming, retomando do último byte recebido após falhas transitórias
+
+        Google Docs são exportados no formato export_as (.docx por padrão). Sem fh, usa um buffer que só é
+        gravado em disco acima de SPOOL_MAX_BYTES. Exportações não aceitam Range e recomeçam do início.
+        """
+        if mime_type == GOOGLE_DOC_MIME_TYPE:
+            url, params, resumable = f'{DRIVE_API}/files/{file_id}/export', {'mimeType': export_as}, False
+        else:
+            url, params, resumable = f'{DRIVE_API}/files/{file_id}', {'alt': 'media'}, True
+        if fh is None:
+            fh = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, suffix='.docx')
+        start = fh.tell()
+        attempt = 0
+        while True:
+            written = fh.tell() - start
+            headers = {'Authorization': f'Bearer {await self._token()}'}
+            if resumable and written:
+                headers['Range'] = f'bytes={written}-'
+            elif written:
+                fh.seek(start)
+                fh.truncate()
+                written = 0
+            try:
+                await self._stream_to(fh, url, params, headers, start, written)
+                break
+            except (httpx.TransportError, HttpError) as e:
+                status = e.resp.status if isinstance(e, HttpError) else None
+                if status is not None and status not in RETRY_STATUS and not is_throttled(status, e.content):
+                    raise
+                if attempt >= DRIVE_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                attempt += 1
+                print(f"async_drive: Falha transitória no download de {file_id} ({e}); retomando em {delay:.1f}s")
+                await asyncio.sleep(delay)
+        BYTES.inc(fh.tell() - start, direction='download')
+        fh.seek(start)
+        return fh
+
+    async def _stream_to(self, fh, url, params, headers, start=0, written=0):
+        """Grava o corpo da resposta em fh; a vaga no escalonador fica reservada durante todo o stream
+
+        Com written, o pedido é uma retomada: só um 206 cujo Content-Range começa em written continua
+        o arquivo. Um 200 traz o arquivo inteiro, gravado de novo a partir de start.
+        """
+        await self.scheduler.acquire_async(self.user)
+        throttled, retry_after = False, 0.0
+        try:
+            async with self.http.stream('GET', url, params=params, headers=headers) as response:
+                if response.status_code >= 400:
+                    content = await response.aread()
+                    throttled = is_throttled(response.status_code, content)
+                    retry_after = retry_after_seconds(response.headers) if throttled else 0.0
+                    raise _http_error(response.status_code, content, url)
+                if written and not (response.status_code == 206 and
+                                    response.headers.get('content-range', '').startswith(f'bytes {written}-')):
+                    fh.seek(start)
+                    fh.truncate()
+                    if response.status_code == 206:
+                        # Trecho diferente do pedido: descarta o parcial e a próxima tentativa baixa tudo
+                        raise httpx.RemoteProtocolError(
+                            f"Content-Range inesperado na retomada: {response.headers.get('content-range')}")
+                async for chunk in response.aiter_bytes(DRIVE_CHUNK_SIZE):
+                    fh.write(chunk)
+        finally:
+            self.scheduler.release(self.user, throttled, retry_after)
+
+    async def upload(self, metadata, data, file_id=None, fields='id,webViewLink'):
+        """Cria (ou, com file_id, atualiza) um arquivo com o conteúdo informado
+
+        Arquivos pequenos vão numa única requisição multipart; os grandes, em sessão resumível por pedaços.
+        """
+        method = 'PATCH' if file_id else 'POST'
+        url = f'{DRIVE_UPLOAD_API}/files' + (f'/{file_id}' if file_id else '')
+        if len(data) > RESUMABLE_THRESHOLD:
+            result = await self._upload_resumable(method, url, metadata, data, fields)
+        else:
+            boundary = uuid.uuid4().hex
+            body = b''.join((
+                f'--{boundary}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n'.encode(),
+                json.dumps(metadata).encode(),
+                f'\r\n--{boundary}\r\nContent-Type: {DOCX_MIME_TYPE}\r\n\r\n'.encode(),
+                data,
+                f'\r\n--{boundary}--'.encode(),
+            ))
+            response = await self._send(
+                method, url, params={'uploadType': 'multipart', 'fields': fields}, content=body,
+                headers={'Content-Type': f'multipart/related; boundary={boundary}'}
+            )
+            result = response.json()
+        BYTES.inc(len(data), direction='upload')
+        return result
+
+    async def _upload_resumable(self, method, url, metadata, data, fields):
+        total = len(data)
+        response = await self._send(
+            method, url, params={'uploadType': 'resumable', 'fields': fields}, json=metadata,
+            headers={'X-Upload-Content-Type': DOCX_MIME_TYPE, 'X-Upload-Content-Length': str(total)}
+        )
+        session_url = response.headers['location']
+        offset = 0
+        failures = 0
+        query_status = False
+        while True:
+            try:
+                if query_status:
+                    # Pergunta ao Drive quantos bytes já chegaram e continua dali
+                    response = await self._put_chunk(session_url, b'', f'bytes */{total}')
+                else:
+                    end = min(offset + DRIVE_CHUNK_SIZE, total)
+                    response = await self._put_chunk(session_url, data[offset:end], f'bytes {offset}-{end - 1}/{total}')
+            except (httpx.TransportError, HttpError) as e:
+                if failures >= DRIVE_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(failures)
+                failures += 1
+                print(f"async_drive: Falha transitória no upload ({e}); retomando em {delay:.1f}s")
+                await asyncio.sleep(delay)
+                query_status = True
+                continue
+            query_status = False
+            if response.status_code in (200, 201):
+                return response.json()
+            if response.status_code != 308:
+                raise _http_error(response.status_code, response.content, session_url)
+            received = response.headers.get('range')
+            offset = int(received.rsplit('-', 1)[1]) + 1 if received else 0
+
+    async def _put_chunk(self, session_url, chunk, content_range):
+        response = await self._request('PUT', session_url, content=chunk, headers={'Content-Range': content_range})
+        if response.status_code in RETRY_STATUS:
+            raise _http_error(response.status_code, response.content, session_url)
+        return response
@@ -0,0 +1,189 @@
+import os
+import sys
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from markdown_converter import MarkdownToDocxConverter, DOCX_BACKENDS, DOCX_BACKEND
+
+OUTPUT_SUFFIX = '_formatado'
+
+_converter = None
+
+
+def _glob_base(pattern):
+    """Parte fixa de um padrão glob (antes do primeiro curinga), usada para espelhar subpastas na saída"""
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    base = os.sep.join(parts) or os.curdir
+    if not os.path.isdir(base):
+        base = os.path.dirname(base) or os.curdir
+    return os.path.abspath(base)
+
+
+def find_inputs(patterns, recursive=False):
+    """Expande diretórios e padrões glob em uma lista de pares (arquivo, diretório base)"""
+    seen = set()
+    inputs = []
+
+    def add(path, base):
+        path = os.path.abspath(path)
+        name = os.path.basename(path)
+        # Ignora arquivos de trava do Word e saídas já geradas
+        if name.startswith('~$') or os.path.splitext(name)[0].endswith(OUTPUT_SUFFIX):
+            return
+        if path not in seen:
+            seen.add(path)
+            inputs.append((path, base))
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            base = os.path.abspath(pattern)
+            if recursive:
+                for root, dirs, files in os.walk(base):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if name.lower().endswith('.docx'):
+                            add(os.path.join(root, name), base)
+            else:
+                for name in sorted(os.listdir(base)):
+                    path = os.path.join(base, name)
+                    if name.lower().endswith('.docx') and os.path.isfile(path):
+                        add(path, base)
+        else:
+            base = _glob_base(pattern)
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path) and path.lower().endswith('.docx'):
+                    add(path, base)
+    return inputs
+
+
+def output_path_for(input_path, base, output_dir=None):
+    """Caminho de saída: ao lado da entrada ou espelhando a estrutura de pastas em output_dir"""
+    name = f"{os.path.splitext(os.path.basename(input_path))[0]}{OUTPUT_SUFFIX}.docx"
+    if output_dir is None:
+        return os.path.join(os.path.dirname(input_path), name)
+    relative_dir = os.path.relpath(os.path.dirname(input_path), base)
+    return os.path.normpath(os.path.join(os.path.abspath(output_dir), relative_dir, name))
+
+
+def is_up_to_date(input_path, output_path):
+    """Indica se a saída já existe e é mais nova que a entrada"""
+    try:
+        return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    except OSError:
+        return False
+
+
+def convert_file(task):
+    """Converte um arquivo (roda no pool de processos); devolve (entrada, saída, erro, bytes, segundos)"""
+    global _converter
+    input_path, output_path, backend = task
+    if _converter is None:
+        _converter = MarkdownToDocxConverter()
+    started = time.perf_counter()
+    size = 0
+    try:
+        size = os.path.getsize(input_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        markdown_text = _converter.extract_text_from_docx(input_path)
+        # Grava em arquivo temporário e renomeia: uma saída interrompida nunca parece atualizada
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        try:
+            _converter.save_markdown_as_docx(markdown_text, temp_path, None, backend)
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        error = None
+    except Exception as e:
+        error = str(e)
+    return input_path, output_path, error, size, time.perf_counter() - started
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_batch(tasks, workers=None, chunksize=None, on_result=None):
+    """Converte as tarefas em paralelo e devolve a lista de resultados de convert_file"""
+    workers = workers or os.cpu_count() or 1
+    if not chunksize:
+        # Lotes grandes o bastante para diluir a comunicação entre processos, mas com várias rodadas por worker
+        chunksize = max(1, min(64, len(tasks) // (workers * 4)))
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(convert_file, tasks, chunksize=chunksize):
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+
+def print_summary(results, skipped, elapsed):
+    converted = [r for r in results if r[2] is None]
+    failed = [r for r in results if r[2] is not None]
+    durations = [r[4] for r in converted]
+    total_bytes = sum(r[3] for r in converted)
+    print("\nResumo da conversão em lote")
+    print("===========================")
+    print(f"Convertidos: {len(converted)}  Ignorados (saída atualizada): {skipped}  Falhas: {len(failed)}")
+    print(f"Tempo total: {elapsed:.2f}s")
+    if elapsed > 0 and converted:
+        print(f"Vazão: {len(converted) / elapsed:.1f} arquivos/s, {total_bytes / elapsed / (1024 * 1024):.2f} MB/s")
+        print(f"Tempo por arquivo: média {sum(durations) / len(durations) * 1000:.1f} ms, "
+              f"p50 {_percentile(durations, 0.5) * 1000:.1f} ms, p95 {_percentile(durations, 0.95) * 1000:.1f} ms")
+    for input_path, _, error, _, _ in failed:
+        print(f"Falha em {input_path}: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Converte em lote arquivos .docx com markdown em documentos Word formatados')
+    parser.add_argument('inputs', nargs='+', help='Diretórios, arquivos ou padrões glob (ex: "relatorios/**/*.docx")')
+    parser.add_argument('--output-dir', '-o', help='Diretório de saída (padrão: ao lado de cada arquivo de entrada)')
+    parser.add_argument('--recursive', '-r', action='store_true', help='Percorre subdiretórios dos diretórios informados')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1, help='Número de processos de conversão')
+    parser.add_argument('--chunksize', '-c', type=int, default=0, help='Arquivos enviados a cada processo por vez (0 = automático)')
+    parser.add_argument('--force', '-f', action='store_true', help='Converte mesmo quando a saída já é mais nova que a entrada')
+    parser.add_argument('--backend', choices=DOCX_BACKENDS, default=DOCX_BACKEND, help='Backend de escrita do .docx')
+    parser.add_argument('--quiet', '-q', action='store_true', help='Mostra apenas o resumo')
+    args = parser.parse_args(argv)
+
+    inputs = find_inputs(args.inputs, args.recursive)
+    if not inputs:
+        print("Nenhum arquivo .docx encontrado.")
+        return 1
+
+    tasks = []
+    skipped = 0
+    for input_path, base in inputs:
+        output_path = output_path_for(input_path, base, args.output_dir)
+        if not args.force and is_up_to_date(input_path, output_path):
+            skipped += 1
+            continue
+        tasks.append((input_path, output_path, args.backend))
+    print(f"{len(inputs)} arquivos encontrados, {len(tasks)} a converter com {args.workers} processos")
+
+    def report(result):
+        if not args.quiet:
+            input_path, output_path, error, _, seconds = result
+            if error:
+                print(f"ERRO {input_path}: {error}")
+            else:
+                print(f"OK {input_path} -> {output_path} ({seconds * 1000:.0f} ms)")
+
+    started = time.perf_counter()
+    results = run_batch(tasks, args.workers, args.chunksize, report) if tasks else []
+    print_summary(results, skipped, time.perf_counter() - started)
+    return 1 if any(r[2] is not None for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,435 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from markdown_converter import MarkdownToDocxConverter, CONVERTER_VERSION, DOCX_BACKENDS, classify_lines
+
+DEFAULT_SIZES = ('1K', '10K', '100K', '1M', '10M', '50M')
+STAGES = ('extract', 'parse', 'save', 'total')
+# Caso extra: backend stream com montagem em pedaços paralelos (--parallel-workers)
+PARALLEL_BACKEND = 'stream-parallel'
+# Tamanhos de pedaço (caracteres) conferidos por --verify, bem menores que DOCX_PARALLEL_CHUNK_CHARS
+VERIFY_CHUNK_CHARS = (200, 1000, 5000, 20000)
+VERIFY_TEXT_BYTES = 200 * 1024
+# Módulos cuja importação é medida em interpretadores novos: linha de comando, pool de conversão e servidor web
+IMPORT_MODULES = ('markdown_converter', 'folder_pipeline', 'app')
+_IMPORT_PROBE = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "import {module}\n"
+    "elapsed = (time.perf_counter() - start) * 1000\n"
+    "google = sorted(m for m in sys.modules if m.split('.')[0] in ('google', 'googleapiclient', 'google_auth_oauthlib'))\n"
+    "print(json.dumps({{'ms': elapsed, 'google': len(google)}}))\n"
+)
+
+# Vocabulário dos relatórios sintéticos (mesmo formato dos documentos reais)
+REPORT_TITLES = (
+    'RELATÓRIO DE EVOLUÇÃO TERAPÊUTICA',
+    'RELATÓRIO DE ACOMPANHAMENTO MULTIDISCIPLINAR',
+    'PLANO TERAPÊUTICO INDIVIDUAL',
+)
+FIELDS = (
+    'NOME DO PARTICIPANTE', 'DATA DE NASCIMENTO', 'IDADE', 'RESPONSÁVEL',
+    'PERÍODO DE AVALIAÇÃO', 'TERAPEUTA RESPONSÁVEL', 'DIAGNÓSTICO',
+)
+# Seções até 10 caracteres (acima disso a linha em maiúsculas vira título)
+SECTIONS = ('PSICOLOGIA', 'PEDAGOGIA', 'NUTRIÇÃO', 'MÚSICA', 'ABA', 'TO')
+NAMES = ('Ana Souza', 'Bruno Lima', 'Carla Dias', 'Davi Rocha', 'Elisa Prado', 'Felipe Nunes')
+WORDS = (
+    'participante', 'apresentou', 'evolução', 'significativa', 'durante', 'as', 'sessões', 'com', 'maior',
+    'autonomia', 'nas', 'atividades', 'de', 'vida', 'diária', 'interação', 'social', 'comunicação',
+    'funcional', 'atenção', 'compartilhada', 'regulação', 'emocional', 'estímulos', 'sensoriais',
+    'família', 'relata', 'melhora', 'no', 'sono', 'e', 'na', 'alimentação', 'seletiva', 'mantém',
+    'acompanhamento', 'semanal', 'com', 'boa', 'adesão', 'ao', 'plano', 'proposto', 'em', 'casa',
+)
+SPECIAL_BULLETS = ('Metas terapêuticas', 'Objetivos terapêuticos', 'Observações')
+
+
+def _sentence(rng, min_words=8, max_words=24):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def _report_lines(rng):
+    """Linhas de um relatório sintético com todos os tipos de linha reconhecidos pelo conversor"""
+    yield rng.choice(REPORT_TITLES)
+    yield ''
+    for field in FIELDS:
+        value = rng.choice(NAMES) if 'NOME' in field or 'RESPONS' in field or 'TERAPEUTA' in field else _sentence(rng, 1, 4)
+        # Parte dos rótulos vem com negrito em markdown, como nos documentos reais
+        yield f'**{field}:** {value}' if rng.random() < 0.3 else f'{field}: {value}'
+    yield ''
+    for section in rng.sample(SECTIONS, rng.randint(2, 4)):
+        yield section
+        for _ in range(rng.randint(1, 3)):
+            yield ' '.join(_sentence(rng) for _ in range(rng.randint(1, 4)))
+        for prefix in SPECIAL_BULLETS[:2]:
+            yield f'- {prefix}: {_sentence(rng, 4, 12)}'
+        for _ in range(rng.randint(1, 4)):
+            yield f"{rng.choice(('-', '•'))} {_sentence(rng, 3, 10)}"
+        if rng.random() < 0.1:
+            yield '-'
+        yield ''
+    yield 'OBSERVAÇÕES'
+    for _ in range(rng.randint(1, 3)):
+        yield _sentence(rng, 10, 30)
+    yield f'• {SPECIAL_BULLETS[2]}: {_sentence(rng, 4, 12)}'
+    yield ''
+
+
+def generate_report_text(target_bytes, seed=0):
+    """Texto markdown sintético com aproximadamente target_bytes (UTF-8), feito de relatórios completos"""
+    rng = random.Random(seed)
+    lines = []
+    size = 0
+    while size < target_bytes:
+        for line in _report_lines(rng):
+            lines.append(line)
+            size += len(line.encode('utf-8')) + 1
+            if size >= target_bytes:
+                break
+    return '\n'.join(lines)
+
+
+def write_source_docx(markdown_text, output):
+    """Grava o texto como .docx de entrada: um parágrafo por linha, com o markdown literal"""
+    from docx_stream_writer import write_docx_fragments, run_xml
+    write_docx_fragments(
+        (f'<w:p>{run_xml(line)}</w:p>' if line else '<w:p/>' for line in markdown_text.split('\n')),
+        output
+    )
+
+
+def parse_size(value):
+    """Converte '1K', '10M', '1.5M' ou '2048' em bytes"""
+    value = value.strip().upper()
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value and value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+def peak_rss_mb():
+    """Pico de memória residente do processo atual, em MB (None sem o módulo resource)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB, macOS em bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _time_run(converter, source_path, backend, executor=None):
+    timings = {}
+    started = time.perf_counter()
+    markdown_text = converter.extract_text_from_docx(source_path)
+    timings['extract'] = time.perf_counter() - started
+
+    stage_started = time.perf_counter()
+    if backend == PARALLEL_BACKEND:
+        # Montagem e gravação se sobrepõem: todo o tempo entra em 'save'
+        from docx_stream_writer import write_docx_parallel
+        timings['parse'] = 0.0
+        write_docx_parallel(markdown_text, io.BytesIO(), executor)
+    elif backend == 'stream':
+        from docx_stream_writer import write_docx_stream
+        records = list(classify_lines(markdown_text))
+        timings['parse'] = time.perf_counter() - stage_started
+        stage_started = time.perf_counter()
+        write_docx_stream(records, io.BytesIO())
+    else:
+        doc = converter.build_document(markdown_text)
+        timings['parse'] = time.perf_counter() - stage_started
+        stage_started = time.perf_counter()
+        doc.save(io.BytesIO())
+    timings['save'] = time.perf_counter() - stage_started
+    timings['total'] = time.perf_counter() - started
+    return timings
+
+
+def run_case(source_path, backend, repeat, workers=0):
+    """Executa um caso (roda em processo próprio para que o pico de memória seja só dele)
+
+    O pico de RSS é o deste processo; no caso paralelo os processos auxiliares não entram na conta.
+    """
+    converter = MarkdownToDocxConverter()
+    executor = ProcessPoolExecutor(max_workers=workers) if backend == PARALLEL_BACKEND else None
+    try:
+        # Aquecimento com um documento pequeno: imports e caches fora da medição
+        warmup = io.BytesIO()
+        write_source_docx(generate_report_text(2048), warmup)
+        _time_run(converter, io.BytesIO(warmup.getvalue()), backend, executor)
+        baseline_rss = peak_rss_mb()
+        runs = [_time_run(converter, source_path, backend, executor) for _ in range(repeat)]
+        peak = peak_rss_mb()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return {
+        'runs': runs,
+        'baseline_rss_mb': baseline_rss,
+        'peak_rss_mb': peak,
+    }
+
+
+def summarize(case, text_bytes):
+    stages = {}
+    for stage in STAGES:
+        values = [run[stage] for run in case['runs']]
+        p50 = percentile(values, 0.5)
+        stages[stage] = {
+            'p50_ms': round(p50 * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'mb_per_s': round(text_bytes / (1024 * 1024) / p50, 3) if p50 > 0 else None,
+        }
+    peak = case['peak_rss_mb']
+    baseline = case['baseline_rss_mb']
+    return {
+        'stages': stages,
+        'peak_rss_mb': round(peak, 1) if peak is not None else None,
+        'rss_growth_mb': round(peak - baseline, 1) if peak is not None else None,
+    }
+
+
+def _document_xml(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        return archive.read('word/document.xml')
+
+
+def _verify_cases(text):
+    """(descrição, min_chars) dos casos de --verify
+
+    Além dos tamanhos fixos, força cortes em volta do primeiro título OBSERVAÇÕES: ele tem mais de 10
+    caracteres e é classificado como título, então o corte mais próximo antes dele é a última seção
+    que o precede; o outro caso corta na primeira seção depois dele. No primeiro pedaço, o corte cai
+    na primeira linha de seção cuja posição no texto é >= min_chars.
+    """
+    from docx_stream_writer import _is_section
+    cases = [(f'pedaços de {chars} caracteres', chars) for chars in VERIFY_CHUNK_CHARS]
+    offsets, offset = [], 0
+    lines = text.split('\n')
+    for line in lines:
+        offsets.append(offset)
+        offset += len(line) + 1
+    title = next((i for i, line in enumerate(lines) if line.strip() == 'OBSERVAÇÕES'), None)
+    if title is not None:
+        before = next((i for i in range(title - 1, -1, -1) if _is_section(lines[i])), None)
+        after = next((i for i in range(title + 1, len(lines)) if _is_section(lines[i])), None)
+        if before:
+            cases.append((f'corte na seção {lines[before]} antes de OBSERVAÇÕES', offsets[before]))
+        if after:
+            cases.append((f'corte na seção {lines[after]} depois de OBSERVAÇÕES', offsets[after]))
+    return cases
+
+
+def verify_parallel(seed=0, workers=2):
+    """Confere que o backend paralelo grava o mesmo document.xml que o serial, com pedaços pequenos
+
+    Devolve o número de casos divergentes.
+    """
+    from docx_stream_writer import write_docx_stream, write_docx_parallel, split_at_sections
+    text = generate_report_text(VERIFY_TEXT_BYTES, seed)
+    serial = io.BytesIO()
+    write_docx_stream(classify_lines(text), serial)
+    expected = _document_xml(serial.getvalue())
+    mismatches = 0
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        for description, min_chars in _verify_cases(text):
+            chunks = len(split_at_sections(text, min_chars))
+            parallel = io.BytesIO()
+            write_docx_parallel(text, parallel, executor, min_chars=min_chars)
+            ok = _document_xml(parallel.getvalue()) == expected
+            mismatches += not ok
+            print(f"{'OK' if ok else 'DIFERENTE':<9} {description}: {chunks} pedaços")
+    return mismatches
+
+
+def measure_imports(modules=IMPORT_MODULES, repeat=3):
+    """Tempo de importação (mediana em ms) de cada módulo em um interpretador novo
+
+    Registra também quantos módulos das bibliotecas do Google a importação carrega (a linha de comando
+    com arquivos locais não deve carregar nenhum).
+    """
+    results = {}
+    for module in modules:
+        times, google = [], None
+        for _ in range(repeat):
+            try:
+                output = subprocess.check_output(
+                    [sys.executable, '-c', _IMPORT_PROBE.format(module=module)],
+                    cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+                )
+            except (OSError, subprocess.CalledProcessError):
+                break
+            probe = json.loads(output.decode().strip().splitlines()[-1])
+            times.append(probe['ms'])
+            google = probe['google']
+        results[module] = {
+            'import_ms': round(percentile(times, 0.5), 1) if times else None,
+            'google_modules': google,
+        }
+    return results
+
+
+def print_imports(imports):
+    print('\nImportação a frio:')
+    for module, result in imports.items():
+        if result['import_ms'] is None:
+            print(f"  {module:<20} falhou")
+        else:
+            print(f"  {module:<20} {result['import_ms']:.1f}ms  módulos do Google: {result['google_modules']}")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, imports=None):
+    """Mostra a variação do p50 de cada etapa em relação a um resultado anterior"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(r['size'], r['backend']): r for r in baseline['results']}
+    print(f"\nComparação com {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for result in results:
+        old = previous.get((result['size'], result['backend']))
+        if not old:
+            continue
+        changes = []
+        for stage in STAGES:
+            before = old['stages'][stage]['p50_ms']
+            after = result['stages'][stage]['p50_ms']
+            if before:
+                changes.append(f"{stage} {(after - before) / before * 100:+.1f}%")
+        print(f"  {result['size']:>6} {result['backend']:<12} " + '  '.join(changes))
+    for module, before in (baseline.get('imports') or {}).items():
+        after = imports.get(module) if imports else None
+        if after and before['import_ms'] and after['import_ms'] is not None:
+            change = (after['import_ms'] - before['import_ms']) / before['import_ms'] * 100
+            print(f"  importação {module:<20} {change:+.1f}%")
+
+
+def print_result(result):
+    stages = result['stages']
+    rss = f"{result['peak_rss_mb']} MB (+{result['rss_growth_mb']})" if result['peak_rss_mb'] is not None else 'n/d'
+    print(
+        f"{result['size']:>6} {result['backend']:<12} "
+        + '  '.join(f"{stage} p50 {stages[stage]['p50_ms']:.1f}ms p99 {stages[stage]['p99_ms']:.1f}ms" for stage in STAGES)
+        + f"  {stages['total']['mb_per_s']} MB/s  pico RSS {rss}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mede extração, montagem e gravação do conversor em documentos sintéticos')
+    parser.add_argument('--sizes', nargs='+', default=list(DEFAULT_SIZES), help='Tamanhos do texto (ex: 1K 10M 50M)')
+    parser.add_argument('--backends', nargs='+', choices=DOCX_BACKENDS, default=list(DOCX_BACKENDS))
+    parser.add_argument('--repeat', '-n', type=int, default=5, help='Execuções por tamanho')
+    parser.add_argument('--parallel-workers', type=int, default=0,
+                        help=f'Inclui o caso {PARALLEL_BACKEND} com este número de processos')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--import-repeat', type=int, default=3,
+                        help='Execuções da medição de importação a frio por módulo (0 desativa)')
+    parser.add_argument('--output', '-o', default='benchmark.json', help='Arquivo JSON com os resultados')
+    parser.add_argument('--compare', help='JSON de uma execução anterior para comparar')
+    parser.add_argument('--corpus-dir', help='Mantém os .docx gerados neste diretório')
+    parser.add_argument('--verify', action='store_true',
+                        help=f'Só confere se {PARALLEL_BACKEND} grava o mesmo documento que o backend stream')
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        mismatches = verify_parallel(args.seed, max(2, args.parallel_workers))
+        return 1 if mismatches else 0
+
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix='converter_bench_')
+    os.makedirs(corpus_dir, exist_ok=True)
+    context = multiprocessing.get_context('spawn')
+    backends = list(args.backends) + ([PARALLEL_BACKEND] if args.parallel_workers > 0 else [])
+    results = []
+    try:
+        for size in args.sizes:
+            target = parse_size(size)
+            text = generate_report_text(target, args.seed)
+            text_bytes = len(text.encode('utf-8'))
+            lines = text.count('\n') + 1
+            source_path = os.path.join(corpus_dir, f'relatorio_{size}.docx')
+            write_source_docx(text, source_path)
+            del text
+            for backend in backends:
+                # Processo novo por caso: o pico de RSS não herda o dos casos anteriores
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    case = executor.submit(run_case, source_path, backend, args.repeat, args.parallel_workers).result()
+                result = {
+                    'size': size,
+                    'text_bytes': text_bytes,
+                    'docx_bytes': os.path.getsize(source_path),
+                    'lines': lines,
+                    'backend': backend,
+                    'repeat': args.repeat,
+                }
+                result.update(summarize(case, text_bytes))
+                results.append(result)
+                print_result(result)
+            if not args.corpus_dir:
+                os.unlink(source_path)
+    finally:
+        if not args.corpus_dir:
+            try:
+                os.rmdir(corpus_dir)
+            except OSError:
+                pass
+
+    imports = measure_imports(repeat=args.import_repeat) if args.import_repeat > 0 else {}
+    if imports:
+        print_imports(imports)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'converter_version': CONVERTER_VERSION,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'parallel_workers': args.parallel_workers,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': results,
+        'imports': imports,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados salvos em {args.output}")
+    if args.compare:
+        compare(results, args.compare, imports)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
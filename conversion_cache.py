@@ -0,0 +1,209 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from markdown_converter import FORMAT_VERSION
+from google_drive_integration import is_text_export
+
+# Limites do cache de conversões (0 desativa a camada correspondente)
+CACHE_MEMORY_BYTES = int(os.environ.get('CONVERSION_CACHE_MEMORY_BYTES', 64 * 1024 * 1024))
+CACHE_DISK_BYTES = int(os.environ.get('CONVERSION_CACHE_DISK_BYTES', 512 * 1024 * 1024))
+CACHE_DIR = os.environ.get('CONVERSION_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'converter_cache'))
+# O uso do disco é estimado a cada gravação; o diretório só é varrido quando a estimativa passa do limite
+# ou depois deste intervalo (para contar o que os outros workers gravaram)
+CACHE_DISK_SCAN_SECONDS = int(os.environ.get('CONVERSION_CACHE_DISK_SCAN_SECONDS', 300))
+
+
+def key_for_content(content):
+    """Chave de cache a partir do conteúdo do arquivo de origem"""
+    return f"sha256:{hashlib.sha256(content).hexdigest()}:v{FORMAT_VERSION}"
+
+
+def key_for_metadata(file_metadata):
+    """Chave de cache a partir dos metadados do Drive (md5Checksum ou id + modifiedTime)
+
+    Retorna None se os metadados não bastam para identificar a versão do arquivo.
+    """
+    if file_metadata.get('md5Checksum'):
+        return f"md5:{file_metadata['md5Checksum']}:v{FORMAT_VERSION}"
+    if file_metadata.get('id') and file_metadata.get('modifiedTime'):
+        # Google Docs não têm md5Checksum; as conversões da exportação em texto ficam separadas das do .docx
+        export = ':text' if is_text_export(file_metadata.get('mimeType')) else ''
+        return f"drive:{file_metadata['id']}:{file_metadata['modifiedTime']}:v{FORMAT_VERSION}{export}"
+    return None
+
+
+class ConversionCache:
+    """Cache dos .docx convertidos com camadas em memória e em disco, ambas com despejo LRU"""
+
+    def __init__(self, max_memory_bytes=None, max_disk_bytes=None, cache_dir=None):
+        self.max_memory_bytes = CACHE_MEMORY_BYTES if max_memory_bytes is None else max_memory_bytes
+        self.max_disk_bytes = CACHE_DISK_BYTES if max_disk_bytes is None else max_disk_bytes
+        self.cache_dir = cache_dir or CACHE_DIR
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Bytes em disco desde a última varredura (None: ainda não varrido)
+        self._disk_bytes = None
+        self._disk_scanned_at = 0.0
+        self._disk_scanning = False
+        if self.max_disk_bytes:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest() + '.docx')
+
+    def get(self, key):
+        """Retorna os bytes convertidos para a chave, ou None"""
+        if key is None:
+            return None
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put_memory(key, data)
+        return data
+
+    def put(self, key, data):
+        """Armazena os bytes convertidos nas duas camadas"""
+        if key is None:
+            return
+        with self._lock:
+            self._put_memory(key, data)
+        self._write_disk(key, data)
+
+    def _put_memory(self, key, data):
+        if len(data) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _read_disk(self, key):
+        if not self.max_disk_bytes:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Atualiza o horário de acesso usado no despejo LRU
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def _write_disk(self, key, data):
+        if not self.max_disk_bytes or len(data) > self.max_disk_bytes:
+            return
+        path = self._disk_path(key)
+        try:
+            # Grava em arquivo temporário e renomeia, já que outros workers podem ler o mesmo diretório
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(temp_path, path)
+            self._track_disk(len(data) - replaced)
+        except OSError as e:
+            print(f"conversion_cache: Erro ao gravar no cache em disco: {e}")
+
+    def _track_disk(self, added):
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += added
+            now = time.monotonic()
+            scan = not self._disk_scanning and (
+                self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes
+                or now - self._disk_scanned_at > CACHE_DISK_SCAN_SECONDS
+            )
+            if not scan:
+                return
+            self._disk_scanning = True
+        try:
+            total = self._evict_disk()
+        finally:
+            with self._lock:
+                self._disk_scanning = False
+                self._disk_scanned_at = time.monotonic()
+        with self._lock:
+            self._disk_bytes = total
+
+    def _evict_disk(self):
+        """Varre o diretório, remove os arquivos menos usados acima do limite e devolve o total em disco"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.docx'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_disk_bytes:
+            return total
+        # Despeja até 90% do limite: com o cache cheio, a próxima varredura só vem depois de várias gravações
+        target = self.max_disk_bytes * 0.9
+        entries.sort()
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+        return total
+
+    def stats(self):
+        """Contadores de acertos e faltas para monitoramento"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'converter_version': FORMAT_VERSION,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_conversion_cache():
+    """Retorna o cache de conversões compartilhado pelo processo"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ConversionCache()
+        return _default_cache
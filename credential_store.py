@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import secrets
+import sqlite3
+import tempfile
+import threading
+
+# As credenciais ficam no servidor; o cookie da sessão leva só um id aleatório.
+# O banco é compartilhado pelos workers do gunicorn, então um token renovado vale para todos.
+CREDENTIALS_DB_PATH = os.environ.get(
+    'CREDENTIALS_DB_PATH', os.path.join(tempfile.gettempdir(), 'converter_credentials.sqlite3')
+)
+# Sessões sem uso por mais tempo que isso expiram e o usuário precisa autenticar de novo
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', 30 * 24 * 3600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS credentials (
+    id TEXT PRIMARY KEY,
+    info TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS credentials_expires ON credentials (expires_at);
+"""
+
+
+def credentials_to_info(creds):
+    """Dicionário serializável das credenciais (formato de Credentials.from_authorized_user_info)"""
+    return {
+        'token': creds.token,
+        'refresh_token': creds.refresh_token,
+        'token_uri': creds.token_uri,
+        'client_id': creds.client_id,
+        'client_secret': creds.client_secret,
+        'scopes': list(creds.scopes) if creds.scopes else None,
+        'expiry': creds.expiry.isoformat() if creds.expiry else None
+    }
+
+
+class CredentialStore:
+    """Credenciais OAuth por sessão em SQLite, com expiração por inatividade"""
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or CREDENTIALS_DB_PATH
+        self.ttl = ttl or SESSION_TTL_SECONDS
+        self._local = threading.local()
+        created = not os.path.exists(self.path)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        if created:
+            # Contém refresh tokens: só o usuário do servidor pode ler
+            os.chmod(self.path, 0o600)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # Uma conexão aberta antes do fork (gunicorn com preload) não pode ser usada pelo processo filho
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, info):
+        """Guarda as credenciais e devolve o id da sessão que vai no cookie"""
+        session_id = secrets.token_urlsafe(32)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO credentials (id, info, created_at, expires_at) VALUES (?, ?, ?, ?)',
+                (session_id, json.dumps(info), now, now + self.ttl)
+            )
+        # Novas sessões são raras: aproveita para remover as expiradas
+        self.purge()
+        return session_id
+
+    def get(self, session_id):
+        """Credenciais (dicionário) da sessão, ou None se não existir ou tiver expirado"""
+        if not session_id:
+            return None
+        conn = self._connect()
+        row = conn.execute('SELECT info, expires_at FROM credentials WHERE id=?', (session_id,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row['expires_at'] < now:
+            self.delete(session_id)
+            return None
+        # Renova o prazo só depois de consumida metade dele, para não gravar a cada requisição
+        if row['expires_at'] - now < self.ttl / 2:
+            with conn:
+                conn.execute('UPDATE credentials SET expires_at=? WHERE id=?', (now + self.ttl, session_id))
+        return json.loads(row['info'])
+
+    def save_token(self, session_id, creds):
+        """Grava o token renovado para que os outros workers não precisem renová-lo de novo
+
+        Só substitui o token guardado se o novo expira depois: um worker com um token antigo (ainda
+        válido) não desfaz a renovação feita por outro.
+        """
+        info = credentials_to_info(creds)
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE credentials SET info=? WHERE id=? AND COALESCE(json_extract(info, '$.expiry'), '') < ?",
+                (json.dumps(info), session_id, info['expiry'] or '')
+            )
+
+    def delete(self, session_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM credentials WHERE id=?', (session_id,))
+
+    def purge(self):
+        """Remove sessões expiradas"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM credentials WHERE expires_at < ?', (time.time(),))
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_credential_store():
+    """Retorna o armazenamento de credenciais compartilhado pelo processo"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = CredentialStore()
+        return _default_store
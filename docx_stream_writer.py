@@ -0,0 +1,206 @@
+import os
+import re
+import zipfile
+import threading
+from collections import deque
+
+from docx.shared import Pt
+
+import docx_templates
+
+from markdown_converter import TITLE, FIELD, SECTION, BULLET, classify_lines
+
+DOCUMENT_PART = 'word/document.xml'
+# Quantidade de parágrafos acumulados antes de cada escrita no zip
+FLUSH_EVERY = 256
+# Tamanho mínimo (em caracteres de markdown) de cada pedaço na conversão paralela
+PARALLEL_CHUNK_CHARS = int(os.environ.get('DOCX_PARALLEL_CHUNK_CHARS', 1024 * 1024))
+
+# Mesmo XML que o python-docx gera para cada formatação usada pelo conversor
+TITLE_PPR = '<w:pPr><w:jc w:val="center"/></w:pPr>'
+BULLET_PPR = '<w:pPr><w:pStyle w:val="ListBullet"/></w:pPr>'
+INDENT_PPR = f'<w:pPr><w:ind w:left="{Pt(20).twips}"/></w:pPr>'
+BOLD_RPR = '<w:rPr><w:b/></w:rPr>'
+RUN_RPRS = {
+    (False, False): '',
+    (True, False): BOLD_RPR,
+    (False, True): '<w:rPr><w:i/></w:rPr>',
+    (True, True): '<w:rPr><w:b/><w:i/></w:rPr>',
+}
+
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_RUN_BREAKS = re.compile(r'([\t\r\n])')
+
+_template = None
+_template_lock = threading.Lock()
+
+
+class _Template:
+    """Partes do pacote do modelo de documento (veja docx_templates), com o corpo dividido no sectPr final"""
+
+    def __init__(self):
+        self.parts = docx_templates.get_template().parts
+        document_xml = dict(self.parts)[DOCUMENT_PART]
+        # Os parágrafos entram entre <w:body> e o <w:sectPr> final
+        split_at = document_xml.rindex(b'<w:sectPr')
+        self.document_prefix = document_xml[:split_at]
+        self.document_suffix = document_xml[split_at:]
+
+
+def get_template():
+    """Retorna o modelo do pacote, carregado uma vez por processo"""
+    global _template
+    with _template_lock:
+        if _template is None:
+            _template = _Template()
+        return _template
+
+
+def _escape(text):
+    if _INVALID_XML_CHARS.search(text):
+        raise ValueError('All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters')
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _text_xml(text):
+    if len(text.strip()) < len(text):
+        return f'<w:t xml:space="preserve">{_escape(text)}</w:t>'
+    return f'<w:t>{_escape(text)}</w:t>'
+
+
+def run_xml(text, bold=False, italic=False):
+    """XML de um run, com as mesmas regras de tabulação e quebra de linha do python-docx"""
+    rpr = RUN_RPRS[bold, italic]
+    if not text:
+        return f'<w:r>{rpr}</w:r>' if rpr else '<w:r/>'
+    if '\t' in text or '\r' in text or '\n' in text:
+        content = []
+        for piece in _RUN_BREAKS.split(text):
+            if piece == '\t':
+                content.append('<w:tab/>')
+            elif piece in ('\r', '\n'):
+                content.append('<w:br/>')
+            elif piece:
+                content.append(_text_xml(piece))
+        return f'<w:r>{rpr}{"".join(content)}</w:r>'
+    return f'<w:r>{rpr}{_text_xml(text)}</w:r>'
+
+
+def content_xml(text, inline, bold=False):
+    """Runs do texto, ou dos segmentos da formatação inline quando houver (bold força negrito em todos)"""
+    if inline is None:
+        return run_xml(text, bold)
+    return ''.join(run_xml(segment.text, bold or segment.bold, segment.italic) for segment in inline)
+
+
+def paragraph_xml(record):
+    """XML de um parágrafo a partir de um registro de linha do classificador"""
+    kind = record.kind
+    inline = record.inline
+    if kind == TITLE:
+        return f'<w:p>{TITLE_PPR}{content_xml(record.text, inline, True)}</w:p>'
+    if kind == FIELD:
+        value = content_xml(record.value, inline) if record.value is not None else ''
+        return f'<w:p>{run_xml(record.label, True)}{value}</w:p>'
+    if kind == SECTION:
+        return f'<w:p>{content_xml(record.text, inline, True)}</w:p>'
+    if kind == BULLET:
+        if record.label is not None:
+            value = content_xml(record.value, inline) if record.value is not None else ''
+            return f'<w:p>{BULLET_PPR}{run_xml(record.label, True)}{value}</w:p>'
+        return f'<w:p>{BULLET_PPR}{content_xml(record.text, inline)}</w:p>'
+    ppr = INDENT_PPR if record.indent else ''
+    return f'<w:p>{ppr}{content_xml(record.text, inline)}</w:p>'
+
+
+def write_docx_stream(records, output):
+    """Grava o .docx parágrafo a parágrafo direto no zip de saída (caminho ou objeto de arquivo)
+
+    O uso de memória não depende do tamanho do documento: só um lote de parágrafos fica em memória.
+    """
+    write_docx_fragments((paragraph_xml(record) for record in records), output)
+
+
+def _batched(fragments):
+    batch = []
+    for fragment in fragments:
+        batch.append(fragment)
+        if len(batch) >= FLUSH_EVERY:
+            yield ''.join(batch).encode('utf-8')
+            batch.clear()
+    if batch:
+        yield ''.join(batch).encode('utf-8')
+
+
+def write_docx_fragments(fragments, output):
+    """Grava o .docx a partir de fragmentos de XML de parágrafo já prontos"""
+    write_docx_body(_batched(fragments), output)
+
+
+def write_docx_body(body_chunks, output):
+    """Grava o .docx a partir de pedaços do corpo do documento (XML de parágrafos em UTF-8)"""
+    template = get_template()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in template.parts:
+            if name != DOCUMENT_PART:
+                zf.writestr(name, data)
+                continue
+            with zf.open(name, 'w') as part:
+                part.write(template.document_prefix)
+                for chunk in body_chunks:
+                    part.write(chunk)
+                part.write(template.document_suffix)
+
+
+def _is_section(line):
+    record = next(classify_lines(line), None)
+    return record is not None and record.kind == SECTION
+
+
+def split_at_sections(markdown_text, min_chars=None):
+    """Divide o texto em pedaços de pelo menos min_chars caracteres, sempre antes de uma linha de seção
+
+    A seção atual é o único estado do classificador entre linhas e é redefinida em cada seção, então
+    classificar os pedaços separadamente dá exatamente os mesmos registros que o texto inteiro.
+    """
+    min_chars = min_chars or PARALLEL_CHUNK_CHARS
+    lines = markdown_text.split('\n')
+    chunks = []
+    start = 0
+    size = 0
+    for i, line in enumerate(lines):
+        if size >= min_chars and _is_section(line):
+            chunks.append('\n'.join(lines[start:i]))
+            start = i
+            size = 0
+        size += len(line) + 1
+    chunks.append('\n'.join(lines[start:]))
+    return chunks
+
+
+def chunk_xml(markdown_text):
+    """XML (UTF-8) dos parágrafos de um pedaço do texto (roda nos processos de conversão)"""
+    return ''.join(paragraph_xml(record) for record in classify_lines(markdown_text)).encode('utf-8')
+
+
+def write_docx_parallel(markdown_text, output, executor, min_chars=None, max_pending=None):
+    """Grava o .docx montando o XML dos pedaços do texto em paralelo no executor e juntando-os em ordem
+
+    O resultado é o mesmo de write_docx_stream; textos menores que dois pedaços são gravados sem paralelismo.
+    No máximo max_pending pedaços ficam prontos à espera da gravação.
+    """
+    chunks = split_at_sections(markdown_text, min_chars)
+    if len(chunks) == 1:
+        write_docx_stream(classify_lines(markdown_text), output)
+        return
+    max_pending = max_pending or 2 * (getattr(executor, '_max_workers', None) or os.cpu_count() or 1)
+    chunks.reverse()
+
+    def body_chunks():
+        pending = deque()
+        while chunks or pending:
+            while chunks and len(pending) < max_pending:
+                pending.append(executor.submit(chunk_xml, chunks.pop()))
+            yield pending.popleft().result()
+
+    write_docx_body(body_chunks(), output)
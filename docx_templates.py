@@ -0,0 +1,82 @@
+import io
+import os
+import copy
+import hashlib
+import zipfile
+import threading
+
+import docx
+from docx.opc.parts.coreprops import CorePropertiesPart
+from docx.shared import Pt
+
+# Modelo .docx próprio (ex: papel timbrado da empresa); sem ele, usa o modelo padrão do python-docx
+DOCX_TEMPLATE_PATH = os.environ.get('DOCX_TEMPLATE_PATH') or None
+# Margens aplicadas ao modelo padrão; modelos próprios mantêm a configuração de página deles
+DEFAULT_MARGIN = Pt(72)
+# Estilos que o conversor referencia e que o modelo precisa ter
+REQUIRED_STYLES = ('List Bullet',)
+
+
+class DocumentTemplate:
+    """Modelo de documento carregado uma vez por processo, do qual cada conversão recebe uma cópia barata
+
+    Só o corpo (document.xml) e as propriedades (core.xml) são copiados; estilos, numeração, tema e as
+    demais partes são compartilhados com o modelo e não podem ser alterados pelas conversões.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.document = docx.Document(path)
+        if path is None:
+            for section in self.document.sections:
+                section.left_margin = DEFAULT_MARGIN
+                section.right_margin = DEFAULT_MARGIN
+                section.top_margin = DEFAULT_MARGIN
+                section.bottom_margin = DEFAULT_MARGIN
+        for name in REQUIRED_STYLES:
+            try:
+                self.document.styles[name]
+            except KeyError:
+                raise ValueError(f"O modelo {path} não tem o estilo '{name}' usado pelo conversor")
+        # Grava uma vez: valida o modelo e dá as partes prontas para o backend stream
+        buffer = io.BytesIO()
+        self.document.save(buffer)
+        with zipfile.ZipFile(buffer) as zf:
+            self.parts = [(name, zf.read(name)) for name in zf.namelist()]
+        self._shared = [
+            part for part in self.document.part.package.iter_parts()
+            if part is not self.document.part and not isinstance(part, CorePropertiesPart)
+        ]
+
+    def new_document(self):
+        """Documento python-docx novo, equivalente a abrir o modelo (cerca de 30x mais rápido)"""
+        memo = {id(part): part for part in self._shared}
+        return copy.deepcopy(self.document, memo)
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_template(path=None):
+    """Modelo carregado (DOCX_TEMPLATE_PATH ou o padrão), compartilhado pelo processo"""
+    path = path or DOCX_TEMPLATE_PATH
+    with _templates_lock:
+        template = _templates.get(path)
+        if template is None:
+            template = _templates[path] = DocumentTemplate(path)
+        return template
+
+
+def new_document(path=None):
+    """Cópia do modelo pronta para receber o conteúdo convertido"""
+    return get_template(path).new_document()
+
+
+def template_fingerprint(path=None):
+    """Identificador do conteúdo do modelo próprio (None com o modelo padrão), usado na versão das saídas"""
+    path = path or DOCX_TEMPLATE_PATH
+    if path is None:
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
@@ -0,0 +1,94 @@
+import io
+import posixpath
+import zipfile
+
+from lxml import etree
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W_BODY = f'{{{W_NS}}}body'
+W_P = f'{{{W_NS}}}p'
+W_R = f'{{{W_NS}}}r'
+W_HYPERLINK = f'{{{W_NS}}}hyperlink'
+W_T = f'{{{W_NS}}}t'
+W_BR = f'{{{W_NS}}}br'
+W_TYPE = f'{{{W_NS}}}type'
+
+# Equivalente em texto dos elementos de um run, como no python-docx (Run.text)
+RUN_CHAR_ELEMENTS = {
+    f'{{{W_NS}}}tab': '\t',
+    f'{{{W_NS}}}ptab': '\t',
+    f'{{{W_NS}}}cr': '\n',
+    f'{{{W_NS}}}noBreakHyphen': '-',
+}
+
+PACKAGE_RELS = '_rels/.rels'
+OFFICE_DOCUMENT_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+DEFAULT_DOCUMENT_PART = 'word/document.xml'
+
+
+def _run_text(r, parts):
+    for child in r:
+        tag = child.tag
+        if tag == W_T:
+            if child.text:
+                parts.append(child.text)
+        elif tag == W_BR:
+            # Quebras de página e de coluna não viram texto
+            if child.get(W_TYPE, 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        else:
+            char = RUN_CHAR_ELEMENTS.get(tag)
+            if char:
+                parts.append(char)
+
+
+def _paragraph_text(p):
+    parts = []
+    for child in p:
+        if child.tag == W_R:
+            _run_text(child, parts)
+        elif child.tag == W_HYPERLINK:
+            for r in child:
+                if r.tag == W_R:
+                    _run_text(r, parts)
+    return ''.join(parts)
+
+
+def _document_part_name(zf):
+    """Nome da parte principal do documento, conforme os relacionamentos do pacote"""
+    try:
+        rels = etree.fromstring(zf.read(PACKAGE_RELS))
+    except KeyError:
+        return DEFAULT_DOCUMENT_PART
+    for rel in rels:
+        if rel.get('Type') == OFFICE_DOCUMENT_REL:
+            return posixpath.normpath(rel.get('Target', DEFAULT_DOCUMENT_PART).lstrip('/'))
+    return DEFAULT_DOCUMENT_PART
+
+
+def iter_paragraph_texts(source):
+    """Gera o texto de cada parágrafo do corpo de um .docx (caminho, bytes ou objeto de arquivo)
+
+    Lê o document.xml em streaming e descarta cada bloco depois de processado, como o
+    Document.paragraphs do python-docx: só parágrafos de primeiro nível (fora de tabelas).
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with zipfile.ZipFile(source) as zf:
+        with zf.open(_document_part_name(zf)) as document_xml:
+            for _, elem in etree.iterparse(document_xml, events=('end',), resolve_entities=False,
+                                          no_network=True, huge_tree=False):
+                parent = elem.getparent()
+                if parent is None or parent.tag != W_BODY:
+                    continue
+                if elem.tag == W_P:
+                    yield _paragraph_text(elem)
+                # Libera o bloco já lido e os irmãos anteriores
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+
+def extract_docx_text(source):
+    """Texto dos parágrafos do .docx, unidos por quebra de linha"""
+    return '\n'.join(iter_paragraph_texts(source))
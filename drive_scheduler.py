@@ -0,0 +1,285 @@
+import os
+import time
+import random
+import asyncio
+import threading
+
+import httplib2
+
+# Taxa máxima de requisições ao Drive por processo (quota de projeto) e rajada permitida
+DRIVE_REQUESTS_PER_SECOND = float(os.environ.get('DRIVE_REQUESTS_PER_SECOND', 50))
+DRIVE_REQUESTS_BURST = int(os.environ.get('DRIVE_REQUESTS_BURST', 50))
+# Janela de requisições simultâneas: cresce 1 por janela bem-sucedida e cai pela metade a cada limitação (AIMD)
+DRIVE_MAX_CONCURRENCY = int(os.environ.get('DRIVE_MAX_CONCURRENCY', 32))
+DRIVE_MIN_CONCURRENCY = int(os.environ.get('DRIVE_MIN_CONCURRENCY', 1))
+# Novas tentativas de uma requisição limitada (429, 403 de quota) ou com erro 5xx
+DRIVE_MAX_RETRIES = int(os.environ.get('DRIVE_MAX_RETRIES', 6))
+DRIVE_BACKOFF_BASE = float(os.environ.get('DRIVE_BACKOFF_BASE', 0.5))
+DRIVE_BACKOFF_MAX = float(os.environ.get('DRIVE_BACKOFF_MAX', 32))
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded')
+
+
+def is_throttled(status, content):
+    """Indica se a resposta é uma limitação de taxa do Drive (429 ou 403 de quota)"""
+    if status == 429:
+        return True
+    return status == 403 and isinstance(content, bytes) and any(reason in content for reason in RATE_LIMIT_REASONS)
+
+
+def retry_after_seconds(resp):
+    """Segundos pedidos no cabeçalho Retry-After (0 se ausente ou em formato de data)"""
+    try:
+        return max(0.0, float(resp.get('retry-after', 0)))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def backoff_delay(attempt):
+    """Backoff exponencial com jitter completo"""
+    return random.uniform(0, min(DRIVE_BACKOFF_MAX, DRIVE_BACKOFF_BASE * (2 ** attempt)))
+
+
+class DriveScheduler:
+    """Escalonador compartilhado das requisições ao Drive do processo
+
+    Combina um balde de fichas (taxa do projeto), uma janela de concorrência adaptativa (AIMD) e uma
+    divisão justa da janela entre os usuários que estão esperando, para que a pasta grande de um
+    usuário não esgote a quota dos demais.
+    """
+
+    def __init__(self, rate=None, burst=None, max_concurrency=None, min_concurrency=None):
+        self.rate = rate or DRIVE_REQUESTS_PER_SECOND
+        self.burst = burst or DRIVE_REQUESTS_BURST
+        self.max_concurrency = max_concurrency or DRIVE_MAX_CONCURRENCY
+        self.min_concurrency = min_concurrency or DRIVE_MIN_CONCURRENCY
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._user_in_flight = {}
+        self._user_waiting = {}
+        self._user_paused_until = {}
+        self._cond = threading.Condition()
+        # Esperas do modo ASGI: (loop, future) acordados a cada liberação, como as threads na condição
+        self._async_waiters = []
+        self.throttled = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _admission_delay(self, user, now):
+        """0 se o usuário pode enviar agora; senão, quanto esperar (None = até uma liberação)"""
+        paused_until = self._user_paused_until.get(user, 0)
+        if now < paused_until:
+            return paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        # Com outros usuários esperando, cada um fica com sua parte da janela
+        others_waiting = any(u != user for u in self._user_waiting)
+        if others_waiting:
+            active = len(set(self._user_waiting) | {u for u, n in self._user_in_flight.items() if n})
+            share = max(1, int(self.limit) // max(1, active))
+            if self._user_in_flight.get(user, 0) >= share:
+                return None
+        self._refill(now)
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        return 0
+
+    def _stop_waiting(self, user):
+        self._user_waiting[user] -= 1
+        if not self._user_waiting[user]:
+            del self._user_waiting[user]
+
+    def _admit(self, user):
+        self._tokens -= 1
+        self.in_flight += 1
+        self._user_in_flight[user] = self._user_in_flight.get(user, 0) + 1
+
+    def acquire(self, user):
+        """Espera a vez do usuário e reserva uma vaga na janela"""
+        with self._cond:
+            self._user_waiting[user] = self._user_waiting.get(user, 0) + 1
+            try:
+                while True:
+                    delay = self._admission_delay(user, time.monotonic())
+                    if delay == 0:
+                        break
+                    self._cond.wait(delay)
+            finally:
+                self._stop_waiting(user)
+            self._admit(user)
+
+    async def acquire_async(self, user):
+        """Como acquire, para o loop de eventos: espera sem bloquear a thread do loop"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            self._user_waiting[user] = self._user_waiting.get(user, 0) + 1
+        admitted = False
+        try:
+            while True:
+                with self._cond:
+                    delay = self._admission_delay(user, time.monotonic())
+                    if delay == 0:
+                        self._stop_waiting(user)
+                        self._admit(user)
+                        admitted = True
+                        return
+                    waiter = loop.create_future()
+                    self._async_waiters.append((loop, waiter))
+                try:
+                    await asyncio.wait_for(waiter, delay)
+                except asyncio.TimeoutError:
+                    with self._cond:
+                        if (loop, waiter) in self._async_waiters:
+                            self._async_waiters.remove((loop, waiter))
+        finally:
+            if not admitted:
+                with self._cond:
+                    self._stop_waiting(user)
+
+    def _notify(self):
+        self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                pass  # loop já encerrado
+
+    def release(self, user, throttled=False, retry_after=0.0):
+        """Libera a vaga e ajusta a janela: aumento aditivo no sucesso, corte pela metade na limitação"""
+        with self._cond:
+            self.in_flight -= 1
+            self._user_in_flight[user] -= 1
+            if not self._user_in_flight[user]:
+                del self._user_in_flight[user]
+            if throttled:
+                self.throttled += 1
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+                if retry_after:
+                    until = time.monotonic() + retry_after
+                    self._user_paused_until[user] = max(self._user_paused_until.get(user, 0), until)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+                self._user_paused_until.pop(user, None)
+            self._notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'waiting_users': len(self._user_waiting),
+                'throttled': self.throttled,
+            }
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _replayable(body):
+    # Corpos em stream (pedaços de upload resumível) não podem ser reenviados aqui; a retomada fica com o upload
+    return body is None or isinstance(body, (bytes, str))
+
+
+class ScheduledHttp:
+    """Transporte httplib2 que passa cada requisição pelo escalonador e repete limitações e erros 5xx
+
+    É a única camada de novas tentativas das requisições reenviáveis (as chamadas da biblioteca usam
+    num_retries=0 sobre ele; veja google_drive_integration.library_retries). Falhas de conexão também são
+    repetidas aqui.
+    """
+
+    def __init__(self, http, user, scheduler=None):
+        self.http = http
+        self.user = user
+        self.scheduler = scheduler or get_drive_scheduler()
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        attempt = 0
+        while True:
+            self.scheduler.acquire(self.user)
+            try:
+                resp, content = self.http.request(
+                    uri, method, body=body, headers=headers,
+                    redirections=redirections, connection_type=connection_type
+                )
+            except (OSError, httplib2.HttpLib2Error) as e:
+                self.scheduler.release(self.user)
+                if attempt >= DRIVE_MAX_RETRIES or not _replayable(body):
+                    raise
+                delay = backoff_delay(attempt)
+                attempt += 1
+                print(f"drive_scheduler: {method} {uri.split('?')[0]} falhou ({e}); nova tentativa {attempt} em {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.scheduler.release(self.user)
+                raise
+            throttled = is_throttled(resp.status, content)
+            retry_after = retry_after_seconds(resp) if throttled else 0.0
+            self.scheduler.release(self.user, throttled, retry_after)
+            if not (throttled or resp.status in RETRY_STATUS) or attempt >= DRIVE_MAX_RETRIES or not _replayable(body):
+                return resp, content
+            delay = max(retry_after, backoff_delay(attempt))
+            attempt += 1
+            print(f"drive_scheduler: {method} {uri.split('?')[0]} retornou {resp.status}; nova tentativa {attempt} em {delay:.1f}s")
+            time.sleep(delay)
+
+    # Atributos que a google-auth-httplib2 e a googleapiclient leem ou alteram no transporte
+    @property
+    def connections(self):
+        return self.http.connections
+
+    @connections.setter
+    def connections(self, value):
+        self.http.connections = value
+
+    @property
+    def follow_redirects(self):
+        return self.http.follow_redirects
+
+    @follow_redirects.setter
+    def follow_redirects(self, value):
+        self.http.follow_redirects = value
+
+    @property
+    def timeout(self):
+        return self.http.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.http.timeout = value
+
+    @property
+    def redirect_codes(self):
+        return self.http.redirect_codes
+
+    @redirect_codes.setter
+    def redirect_codes(self, value):
+        self.http.redirect_codes = value
+
+    def add_certificate(self, key, cert, domain, password=None):
+        self.http.add_certificate(key, cert, domain, password=password)
+
+    def close(self):
+        self.http.close()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_drive_scheduler():
+    """Escalonador compartilhado por todas as threads do worker"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = DriveScheduler()
+        return _scheduler
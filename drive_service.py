@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import httplib2
+import google_auth_httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+
+from drive_scheduler import ScheduledHttp
+
+# Usuários mantidos no pool de cada worker
+SERVICE_POOL_MAX_USERS = int(os.environ.get('DRIVE_SERVICE_POOL_MAX_USERS', 256))
+DRIVE_HTTP_TIMEOUT = int(os.environ.get('DRIVE_HTTP_TIMEOUT', 120))
+
+_discovery_document = None
+_discovery_lock = threading.Lock()
+
+
+def get_discovery_document():
+    """Documento de descoberta do Drive v3 empacotado na biblioteca, lido uma vez por processo"""
+    global _discovery_document
+    with _discovery_lock:
+        if _discovery_document is None:
+            _discovery_document = json.loads(discovery_cache.get_static_doc('drive', 'v3'))
+        return _discovery_document
+
+
+def user_key(info):
+    """Identificador estável do usuário a partir do dicionário de credenciais"""
+    secret = info.get('refresh_token') or info.get('token') or ''
+    return hashlib.sha256(f"{info.get('client_id')}:{secret}".encode()).hexdigest()
+
+
+def credentials_key(creds):
+    """Mesmo identificador de user_key, a partir de um objeto Credentials"""
+    return user_key({'client_id': creds.client_id, 'refresh_token': creds.refresh_token, 'token': creds.token})
+
+
+class _UserEntry:
+    def __init__(self, creds):
+        self.creds = creds
+        self.lock = threading.Lock()
+
+
+class DriveServicePool:
+    """Pool por worker de credenciais e serviços do Drive
+
+    As credenciais de cada usuário são montadas uma vez e só são renovadas quando o token expira.
+    Cada thread recebe seu próprio serviço (o transporte httplib2 não é thread-safe), reaproveitado
+    entre requisições para manter as conexões HTTP abertas.
+    """
+
+    def __init__(self, max_users=None):
+        self.max_users = max_users or SERVICE_POOL_MAX_USERS
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._refresh_request = None
+
+    def _entry(self, info):
+        key = user_key(info)
+        with self._lock:
+            entry = self._users.get(key)
+            if entry is None:
+                creds = Credentials.from_authorized_user_info(info, info.get('scopes'))
+                entry = _UserEntry(creds)
+                self._users[key] = entry
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(key)
+            return key, entry
+
+    def get_credentials(self, info):
+        """Credenciais válidas do usuário, renovando o token só quando necessário; None se não for possível"""
+        key, entry = self._entry(info)
+        creds = entry.creds
+        if creds.valid:
+            return creds
+        with entry.lock:
+            # Outra thread pode ter renovado enquanto esperávamos
+            if creds.valid:
+                return creds
+            # O token informado pode ter sido renovado por outro worker depois que estas credenciais foram montadas
+            if info.get('token') and info['token'] != creds.token:
+                stored = Credentials.from_authorized_user_info(info, info.get('scopes'))
+                if stored.valid:
+                    creds.token = stored.token
+                    creds.expiry = stored.expiry
+                    return creds
+            if not (creds.expired and creds.refresh_token):
+                print("drive_service: Não foi possível obter credenciais válidas")
+                self.forget(info)
+                return None
+            print("drive_service: Token expirado, renovando")
+            if self._refresh_request is None:
+                # Importação pesada (requests): só quando um token precisa ser renovado
+                from google.auth.transport.requests import Request
+                self._refresh_request = Request()
+            creds.refresh(self._refresh_request)
+        return creds
+
+    def get_service(self, creds):
+        """Serviço do Drive desta thread para as credenciais informadas"""
+        services = getattr(self._local, 'services', None)
+        if services is None:
+            services = self._local.services = OrderedDict()
+        key = id(creds)
+        cached = services.get(key)
+        if cached is not None and cached[0] is creds:
+            services.move_to_end(key)
+            return cached[1]
+        # Todas as chamadas do serviço passam pelo escalonador compartilhado (taxa, backoff e justiça entre usuários)
+        transport = ScheduledHttp(httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT), credentials_key(creds))
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=transport)
+        service = build_from_document(get_discovery_document(), http=http)
+        services[key] = (creds, service)
+        while len(services) > self.max_users:
+            services.popitem(last=False)
+        return service
+
+    def forget(self, info):
+        """Remove o usuário do pool (ex: logout)"""
+        with self._lock:
+            self._users.pop(user_key(info), None)
+
+
+_pool = DriveServicePool()
+
+
+def get_drive_service_pool():
+    """Pool de serviços do Drive compartilhado pelo worker"""
+    return _pool
@@ -0,0 +1,108 @@
+import io
+import sys
+import time
+import argparse
+
+from docx_text_extractor import extract_docx_text
+from markdown_converter import classify_lines
+from google_drive_integration import (
+    DOCX_MIME_TYPE, GOOGLE_DOC_MIME_TYPE, TEXT_MIME_TYPE, download_drive_file, decode_exported_text
+)
+from folder_pipeline import list_folder_files
+
+
+def export(service, file_id, export_as):
+    """Exporta o Google Doc no formato pedido e devolve (bytes, segundos)"""
+    start = time.perf_counter()
+    data = download_drive_file(service, file_id, GOOGLE_DOC_MIME_TYPE, fh=io.BytesIO(), export_as=export_as).getvalue()
+    return data, time.perf_counter() - start
+
+
+def paragraph_lines(text):
+    """Linhas que o classificador considera (sem espaços nas pontas e sem linhas vazias)"""
+    return [line.strip() for line in text.split('\n') if line.strip()]
+
+
+def compare_exports(service, file_id):
+    """Exporta o documento como .docx e como texto e compara o que cada caminho entrega ao conversor"""
+    docx_data, docx_seconds = export(service, file_id, DOCX_MIME_TYPE)
+    text_data, text_seconds = export(service, file_id, TEXT_MIME_TYPE)
+    start = time.perf_counter()
+    docx_text = extract_docx_text(docx_data)
+    docx_extract = time.perf_counter() - start
+    start = time.perf_counter()
+    plain_text = decode_exported_text(text_data)
+    text_extract = time.perf_counter() - start
+
+    docx_lines, text_lines = paragraph_lines(docx_text), paragraph_lines(plain_text)
+    first_difference = None
+    for index in range(max(len(docx_lines), len(text_lines))):
+        a = docx_lines[index] if index < len(docx_lines) else None
+        b = text_lines[index] if index < len(text_lines) else None
+        if a != b:
+            first_difference = (index, a, b)
+            break
+    return {
+        'id': file_id,
+        'lines': (len(docx_lines), len(text_lines)),
+        'bytes': (len(docx_data), len(text_data)),
+        'export_s': (docx_seconds, text_seconds),
+        'extract_s': (docx_extract, text_extract),
+        'first_difference': first_difference,
+        # Mesmo com linhas diferentes (ex: espaços internos), o que importa é a saída do classificador
+        'records_match': list(classify_lines(docx_text)) == list(classify_lines(plain_text)),
+    }
+
+
+def print_result(name, result):
+    docx_bytes, text_bytes = result['bytes']
+    docx_s, text_s = result['export_s']
+    status = 'OK' if result['records_match'] else 'DIFERENTE'
+    print(
+        f"{status:<9} {name}: {result['lines'][0]}/{result['lines'][1]} linhas (docx/texto), "
+        f"{docx_bytes / 1024:.1f}/{text_bytes / 1024:.1f} KB, exportação {docx_s:.2f}/{text_s:.2f}s, "
+        f"extração {result['extract_s'][0] * 1000:.1f}/{result['extract_s'][1] * 1000:.1f}ms"
+    )
+    if result['first_difference'] is not None:
+        index, a, b = result['first_difference']
+        print(f"          linha {index + 1}:\n            docx:  {a!r}\n            texto: {b!r}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compara a exportação de Google Docs como .docx e como texto (GOOGLE_DOC_EXPORT=text)'
+    )
+    parser.add_argument('file_ids', nargs='*', help='IDs de Google Docs')
+    parser.add_argument('--folder', '-f', help='Compara todos os Google Docs desta pasta')
+    args = parser.parse_args(argv)
+    if not args.file_ids and not args.folder:
+        parser.error('informe IDs de documentos ou --folder')
+
+    from googleapiclient.discovery import build
+    from google_auth import get_google_drive_credentials
+    credentials = get_google_drive_credentials()
+    if credentials is None:
+        print("Erro: credenciais do Google Drive não encontradas (token.json)")
+        return 1
+    service = build('drive', 'v3', credentials=credentials)
+
+    files = [{'id': file_id, 'name': file_id} for file_id in args.file_ids]
+    if args.folder:
+        files.extend(f for f in list_folder_files(service, args.folder) if f.get('mimeType') == GOOGLE_DOC_MIME_TYPE)
+
+    mismatches = 0
+    for file in files:
+        try:
+            result = compare_exports(service, file['id'])
+        except Exception as e:
+            print(f"{'ERRO':<9} {file['name']}: {e}")
+            mismatches += 1
+            continue
+        print_result(file['name'], result)
+        mismatches += not result['records_match']
+    print(f"\n{len(files) - mismatches} de {len(files)} documentos com a mesma saída nos dois caminhos")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,454 @@
+import os
+import queue
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import io
+
+from markdown_converter import MarkdownToDocxConverter, DOCX_BACKEND
+from google_drive_integration import (
+    DOCX_MIME_TYPE, GOOGLE_DOC_MIME_TYPE, SPOOL_MAX_BYTES, download_drive_file, media_for_upload, execute_upload,
+    is_text_export, export_mime_type, decode_exported_text
+)
+from conversion_cache import get_conversion_cache, key_for_content, key_for_metadata
+from folder_sync import output_properties, is_output
+from metrics import span, collect_spans, record_spans, FILES
+
+# Limites de concorrência por etapa (podem ser ajustados por variáveis de ambiente)
+DOWNLOAD_WORKERS = int(os.environ.get('FOLDER_DOWNLOAD_WORKERS', 8))
+CONVERT_WORKERS = int(os.environ.get('FOLDER_CONVERT_WORKERS', min(4, os.cpu_count() or 1)))
+UPLOAD_WORKERS = int(os.environ.get('FOLDER_UPLOAD_WORKERS', 4))
+# Máximo de arquivos em memória ao mesmo tempo entre download e upload
+MAX_IN_FLIGHT = int(os.environ.get('FOLDER_MAX_IN_FLIGHT', 16))
+# Sem nenhum arquivo concluído por este tempo, a conversão da pasta é interrompida com erro
+# (evita um job preso para sempre se uma chamada travar)
+FOLDER_STALL_SECONDS = int(os.environ.get('FOLDER_STALL_SECONDS', 1800))
+# Listagens simultâneas de subpastas no modo recursivo
+LIST_WORKERS = int(os.environ.get('FOLDER_LIST_WORKERS', 4))
+# Maior página aceita por files().list
+LIST_PAGE_SIZE = 1000
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """Retorna o pool de processos compartilhado usado na conversão"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # 'spawn' evita herdar locks de threads do processo do servidor
+            _process_pool = ProcessPoolExecutor(
+                max_workers=CONVERT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _process_pool
+
+
+# Campos de cada arquivo na listagem da pasta
+FOLDER_FILE_FIELDS = 'id, name, mimeType, size, md5Checksum, modifiedTime, capabilities(canDownload)'
+
+
+def folder_files_query(folder_id):
+    """Consulta dos arquivos .docx e Google Docs de uma pasta"""
+    return (
+        f"('{folder_id}' in parents) and "
+        "("
+        f"mimeType='{DOCX_MIME_TYPE}' or "
+        f"mimeType='{GOOGLE_DOC_MIME_TYPE}'"
+        ") and trashed=false"
+    )
+
+
+def list_folder_files(service, folder_id):
+    """Lista todos os arquivos .docx e Google Docs de uma pasta do Google Drive"""
+    files = []
+    page_token = None
+    while True:
+        response = service.files().list(
+            q=folder_files_query(folder_id),
+            spaces='drive',
+            fields=f'nextPageToken, files({FOLDER_FILE_FIELDS})',
+            pageSize=LIST_PAGE_SIZE,
+            pageToken=page_token
+        ).execute()
+        files.extend(response.get('files', []))
+        page_token = response.get('nextPageToken', None)
+        if page_token is None:
+            break
+    return files
+
+
+def folder_tree_query(folder_id):
+    """Consulta dos arquivos .docx e Google Docs e das subpastas de uma pasta"""
+    return (
+        f"('{folder_id}' in parents) and "
+        "("
+        f"mimeType='{DOCX_MIME_TYPE}' or "
+        f"mimeType='{GOOGLE_DOC_MIME_TYPE}' or "
+        f"mimeType='{FOLDER_MIME_TYPE}'"
+        ") and trashed=false"
+    )
+
+
+class FolderTreeWalker:
+    """Percorre uma pasta e todas as subpastas com listagens simultâneas
+
+    Os arquivos são entregues em lotes (um por página) assim que cada página chega, para que a conversão
+    comece enquanto a listagem continua. Cada arquivo recebe 'folder_id' (a pasta onde está, que recebe a
+    saída) e 'path' (caminho relativo à raiz). Saídas do próprio conversor são ignoradas. Pastas que não
+    puderam ser listadas ficam em errors, sem interromper o resto da árvore.
+    """
+
+    def __init__(self, service_factory, folder_id, workers=None):
+        self.service_factory = service_factory
+        self.folder_id = folder_id
+        self.workers = workers or LIST_WORKERS
+        self.errors = []
+        self._local = threading.local()
+
+    def _service(self):
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = self._local.service = self.service_factory()
+        return service
+
+    def batches(self):
+        """Gera listas de arquivos à medida que as páginas de cada pasta são listadas"""
+        found = queue.Queue()
+        visited = {self.folder_id}
+        pending = [1]
+        lock = threading.Lock()
+        stopped = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='list')
+
+        def list_folder(folder_id, path):
+            try:
+                page_token = None
+                # Se o consumidor desistiu (gerador fechado), as listagens pendentes terminam sem chamar a API
+                while not stopped.is_set():
+                    with span('list'):
+                        response = self._service().files().list(
+                            q=folder_tree_query(folder_id),
+                            spaces='drive',
+                            fields=f'nextPageToken, files({FOLDER_FILE_FIELDS}, appProperties)',
+                            pageSize=LIST_PAGE_SIZE,
+                            pageToken=page_token
+                        ).execute()
+                    files = []
+                    for item in response.get('files', []):
+                        if item['mimeType'] == FOLDER_MIME_TYPE:
+                            # Pastas com mais de um pai aparecem mais de uma vez na árvore
+                            with lock:
+                                if item['id'] in visited:
+                                    continue
+                                visited.add(item['id'])
+                                pending[0] += 1
+                            pool.submit(list_folder, item['id'], path + (item['name'],))
+                        elif not is_output(item):
+                            item['folder_id'] = folder_id
+                            item['path'] = '/'.join(path + (item['name'],))
+                            files.append(item)
+                    if files:
+                        found.put(files)
+                    page_token = response.get('nextPageToken')
+                    if page_token is None:
+                        break
+            except Exception as e:
+                location = '/'.join(path) or folder_id
+                print(f"convert_folder: Falha ao listar a pasta {location}: {e}")
+                self.errors.append(f"{location}: {e}")
+            finally:
+                with lock:
+                    pending[0] -= 1
+                    if pending[0] == 0:
+                        found.put(None)
+
+        try:
+            pool.submit(list_folder, self.folder_id, ())
+            while True:
+                files = found.get()
+                if files is None:
+                    return
+                yield files
+        finally:
+            stopped.set()
+            pool.shutdown(wait=True)
+
+
+def download_file_content(service, file):
+    """Baixa o conteúdo de um arquivo conforme o tipo: .docx ou, para Google Docs, texto (veja is_text_export)
+
+    Retorna os bytes do arquivo ou, se ele passar de SPOOL_MAX_BYTES, o caminho de um arquivo temporário.
+    """
+    export_as = export_mime_type(file.get('mimeType'))
+    if int(file.get('size') or 0) > SPOOL_MAX_BYTES:
+        with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as temp_file:
+            try:
+                download_drive_file(service, file['id'], file.get('mimeType'), fh=temp_file, export_as=export_as)
+            except Exception:
+                temp_file.close()
+                os.unlink(temp_file.name)
+                raise
+        return temp_file.name
+    buffer = download_drive_file(service, file['id'], file.get('mimeType'), fh=io.BytesIO(), export_as=export_as)
+    return buffer.getvalue()
+
+
+def render_docx(converter, markdown_text, executor=None):
+    """Monta e serializa o documento formatado, medindo as duas etapas separadamente
+
+    Com o backend stream, um executor de processos permite montar documentos grandes em pedaços paralelos.
+    """
+    if DOCX_BACKEND == 'stream':
+        # No backend stream a montagem acontece durante a gravação
+        with span('serialize'):
+            return converter.parse_markdown_to_docx(markdown_text, '', None, executor=executor).getvalue()
+    with span('parse'):
+        doc = converter.build_document(markdown_text)
+    with span('serialize'):
+        buffer = io.BytesIO()
+        doc.save(buffer)
+    return buffer.getvalue()
+
+
+def convert_docx_bytes(file_content):
+    """Converte um .docx (bytes ou caminho temporário) e devolve os bytes do documento formatado (roda no pool de processos)
+
+    Devolve também os spans de extração, montagem e serialização, registrados pelo processo principal.
+    """
+    converter = MarkdownToDocxConverter()
+    with collect_spans() as spans:
+        try:
+            with span('extract'):
+                markdown_text = converter.extract_text_from_docx(file_content)
+        finally:
+            if isinstance(file_content, str):
+                os.unlink(file_content)
+        doc_data = render_docx(converter, markdown_text)
+    return doc_data, spans
+
+
+def convert_text_bytes(data):
+    """Converte texto em UTF-8 (markdown enviado ou Google Doc exportado como texto) e devolve (bytes do .docx, spans)
+
+    Roda no pool de processos, como convert_docx_bytes.
+    """
+    converter = MarkdownToDocxConverter()
+    with collect_spans() as spans:
+        with span('extract'):
+            markdown_text = decode_exported_text(data)
+        doc_data = render_docx(converter, markdown_text)
+    return doc_data, spans
+
+
+def converter_for(file):
+    """Função do pool de processos que converte o conteúdo baixado por download_file_content"""
+    return convert_text_bytes if is_text_export(file.get('mimeType')) else convert_docx_bytes
+
+
+def output_name(file):
+    """Nome do arquivo convertido: o definido pela sincronização ou o nome de origem com data e hora"""
+    return file.get('output_name') or f"{os.path.splitext(file['name'])[0]}_formatado_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
+
+
+def upload_converted_file(service, file, doc_data, folder_id):
+    """Envia o documento convertido para a pasta de destino
+
+    Se o arquivo tiver 'output_id', atualiza essa saída no lugar em vez de criar uma cópia nova. Arquivos com
+    'folder_id' (modo recursivo) vão para a própria pasta em vez de folder_id.
+    """
+    media = media_for_upload(io.BytesIO(doc_data))
+    if file.get('output_id'):
+        return execute_upload(service.files().update(
+            fileId=file['output_id'],
+            body={'appProperties': output_properties(file)},
+            media_body=media,
+            fields='id,webViewLink'
+        ))
+    return execute_upload(service.files().create(
+        body={
+            'name': output_name(file),
+            'mimeType': DOCX_MIME_TYPE,
+            'parents': [file.get('folder_id') or folder_id],
+            'appProperties': output_properties(file)
+        },
+        media_body=media,
+        fields='id,webViewLink'
+    ))
+
+
+class FolderConversionPipeline:
+    """Pipeline de conversão em lote: download e upload em paralelo, conversão em pool de processos"""
+
+    def __init__(self, service_factory, download_workers=None, convert_workers=None,
+                 upload_workers=None, max_in_flight=None):
+        # Os objetos de serviço do Google não são thread-safe: cada thread cria o seu
+        self.service_factory = service_factory
+        self.download_workers = download_workers or DOWNLOAD_WORKERS
+        self.convert_workers = convert_workers or CONVERT_WORKERS
+        self.upload_workers = upload_workers or UPLOAD_WORKERS
+        self.max_in_flight = max_in_flight or MAX_IN_FLIGHT
+        self._local = threading.local()
+
+    def _service(self):
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = self.service_factory()
+            self._local.service = service
+        return service
+
+    def run(self, files, folder_id, on_result=None):
+        """Converte os arquivos e devolve o resultado de cada um (sucesso ou erro)
+
+        on_result, se informado, é chamado com o resultado de cada arquivo assim que ele termina.
+        Se nenhum arquivo terminar em FOLDER_STALL_SECONDS, os que estão em andamento terminam com
+        erro e run levanta TimeoutError.
+        """
+        results = []
+        results_lock = threading.Lock()
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        convert_slots = threading.BoundedSemaphore(self.convert_workers)
+        # Arquivos enviados às etapas e ainda sem resultado, pelo número de ordem na execução:
+        # id() do dicionário seria reaproveitado quando files é um gerador e os concluídos são liberados
+        active = {}
+        finished = set()
+        all_done = threading.Event()
+        all_done.set()
+
+        download_pool = ThreadPoolExecutor(max_workers=self.download_workers, thread_name_prefix='download')
+        upload_pool = ThreadPoolExecutor(max_workers=self.upload_workers, thread_name_prefix='upload')
+        process_pool = get_process_pool()
+        cache = get_conversion_cache()
+
+        def finish(seq, file, stage, error=None, uploaded=None):
+            # Cada arquivo tem um único resultado, mesmo que uma falha tardia chame finish de novo
+            with results_lock:
+                if seq in finished:
+                    return
+                finished.add(seq)
+            result = {
+                'id': file['id'],
+                'name': file['name'],
+                'status': 'error' if error else 'ok',
+                'stage': stage,
+                'link': uploaded.get('webViewLink') if uploaded else None,
+                'error': str(error) if error else None,
+            }
+            FILES.inc(kind='folder', status=result['status'])
+            if error:
+                print(f"convert_folder: Falha em {file['name']} ({file['id']}) na etapa {stage}: {error}")
+            else:
+                print(f"convert_folder: Arquivo convertido enviado: {result['link']}")
+            if on_result:
+                try:
+                    on_result(result)
+                except Exception as e:
+                    print(f"convert_folder: Erro ao registrar resultado de {file['name']}: {e}")
+            with results_lock:
+                results.append(result)
+                acquired = active.pop(seq, None) is not None
+                if not active:
+                    all_done.set()
+            if acquired:
+                in_flight.release()
+
+        def do_upload(seq, file, doc_data, cache_keys=()):
+            try:
+                # A gravação no cache fica nas threads de upload, fora da thread que gerencia o pool de processos
+                for key in cache_keys:
+                    cache.put(key, doc_data)
+                with span('upload'):
+                    uploaded = upload_converted_file(self._service(), file, doc_data, folder_id)
+            except Exception as e:
+                finish(seq, file, 'upload', error=e)
+                return
+            finish(seq, file, 'upload', uploaded=uploaded)
+
+        def on_converted(seq, file, cache_keys, future):
+            convert_slots.release()
+            stage = 'convert'
+            # Toda falha aqui vira o resultado do arquivo: uma exceção perdida deixaria run esperando
+            try:
+                doc_data, spans = future.result()
+                record_spans(spans)
+                stage = 'upload'
+                upload_pool.submit(do_upload, seq, file, doc_data, cache_keys)
+            except Exception as e:
+                finish(seq, file, stage, error=e)
+
+        def do_download(seq, file):
+            stage = 'download'
+            try:
+                # A permissão de download já vem na listagem, sem chamada extra por arquivo
+                if (file.get('capabilities') or {}).get('canDownload') is False:
+                    raise PermissionError('Sem permissão para baixar o arquivo')
+                # Arquivos inalterados já convertidos pulam download e conversão
+                metadata_key = key_for_metadata(file)
+                doc_data = cache.get(metadata_key)
+                if doc_data is not None:
+                    print(f"convert_folder: {file['name']} encontrado no cache de conversões")
+                    do_upload(seq, file, doc_data)
+                    return
+                with span('download'):
+                    file_content = download_file_content(self._service(), file)
+                stage = 'convert'
+                cache_keys = [metadata_key] if metadata_key else []
+                if isinstance(file_content, bytes):
+                    content_key = key_for_content(file_content)
+                    doc_data = cache.get(content_key)
+                    if doc_data is not None:
+                        do_upload(seq, file, doc_data, [metadata_key])
+                        return
+                    cache_keys.append(content_key)
+                # Respeita o limite de conversões simultâneas no pool de processos
+                convert_slots.acquire()
+                try:
+                    future = process_pool.submit(converter_for(file), file_content)
+                except BaseException:
+                    convert_slots.release()
+                    raise
+                future.add_done_callback(lambda f: on_converted(seq, file, cache_keys, f))
+            except Exception as e:
+                finish(seq, file, stage, error=e)
+
+        def wait_progress(wait):
+            """Espera wait(timeout) devolver True; False se nenhum arquivo terminar em FOLDER_STALL_SECONDS"""
+            with results_lock:
+                seen = len(results)
+            while not wait(FOLDER_STALL_SECONDS):
+                with results_lock:
+                    count = len(results)
+                if count == seen:
+                    return False
+                seen = count
+            return True
+
+        stalled = False
+        try:
+            for seq, file in enumerate(files):
+                if not wait_progress(lambda timeout: in_flight.acquire(timeout=timeout)):
+                    stalled = True
+                    break
+                with results_lock:
+                    active[seq] = file
+                    all_done.clear()
+                print(f"convert_folder: Processando {file['name']} ({file['id']}) tipo {file.get('mimeType')}")
+                download_pool.submit(do_download, seq, file)
+            stalled = stalled or not wait_progress(all_done.wait)
+            if stalled:
+                with results_lock:
+                    stuck = list(active.items())
+                error = TimeoutError(f'Nenhum arquivo concluído em {FOLDER_STALL_SECONDS}s; conversão interrompida')
+                for seq, file in stuck:
+                    finish(seq, file, 'timeout', error=error)
+                raise error
+        finally:
+            # Threads presas não seguram o job: sem esperar por elas quando a conversão foi interrompida
+            download_pool.shutdown(wait=not stalled, cancel_futures=stalled)
+            upload_pool.shutdown(wait=not stalled, cancel_futures=stalled)
+        return results
@@ -0,0 +1,244 @@
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+
+from markdown_converter import FORMAT_VERSION
+from google_drive_integration import DOCX_MIME_TYPE, GOOGLE_DOC_MIME_TYPE, batch_execute
+
+# Marcação gravada nos appProperties dos arquivos convertidos
+OUTPUT_MARKER_KEY = 'convertedBy'
+OUTPUT_MARKER_VALUE = 'markdown_converter'
+
+# Page token da Changes API de cada pasta sincronizada, por usuário; em SQLite para ser compartilhado
+# pelos workers do gunicorn
+SYNC_STATE_DB_PATH = os.environ.get(
+    'SYNC_STATE_DB_PATH', os.path.join(tempfile.gettempdir(), 'converter_sync_state.sqlite3')
+)
+# Pastas sem sincronização por mais tempo que isso perdem o token e voltam a ser listadas por inteiro
+SYNC_STATE_RETENTION_SECONDS = int(os.environ.get('SYNC_STATE_RETENTION_SECONDS', 180 * 24 * 3600))
+
+SOURCE_FIELDS = 'id, name, mimeType, parents, trashed, size, md5Checksum, modifiedTime, appProperties, capabilities(canDownload)'
+OUTPUT_FIELDS = 'id, name, modifiedTime, appProperties'
+SOURCE_MIME_TYPES = (DOCX_MIME_TYPE, GOOGLE_DOC_MIME_TYPE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    page_token TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def output_properties(file):
+    """appProperties que ligam o arquivo convertido ao arquivo de origem"""
+    return {
+        OUTPUT_MARKER_KEY: OUTPUT_MARKER_VALUE,
+        'converterSource': file['id'],
+        'converterSourceModified': file.get('modifiedTime') or '',
+        'converterSourceChecksum': file.get('md5Checksum') or '',
+        'converterVersion': FORMAT_VERSION,
+    }
+
+
+def is_output(file):
+    """Indica se o arquivo foi gerado pelo conversor"""
+    return (file.get('appProperties') or {}).get(OUTPUT_MARKER_KEY) == OUTPUT_MARKER_VALUE
+
+
+def is_up_to_date(source, output):
+    """Indica se a saída já corresponde à versão atual do arquivo de origem"""
+    props = output.get('appProperties') or {}
+    return (
+        props.get('converterSourceModified') == (source.get('modifiedTime') or '')
+        and props.get('converterSourceChecksum') == (source.get('md5Checksum') or '')
+        and props.get('converterVersion') == FORMAT_VERSION
+    )
+
+
+class SyncStateStore:
+    """Page tokens das pastas sincronizadas em SQLite"""
+
+    def __init__(self, path=None):
+        self.path = path or SYNC_STATE_DB_PATH
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # Uma conexão aberta antes do fork (gunicorn com preload) não pode ser usada pelo processo filho
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get_page_token(self, key):
+        row = self._connect().execute('SELECT page_token FROM sync_state WHERE key=?', (key,)).fetchone()
+        return row['page_token'] if row else None
+
+    def save_page_token(self, key, page_token):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO sync_state (key, page_token, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET page_token=excluded.page_token, updated_at=excluded.updated_at',
+                (key, page_token, now)
+            )
+            conn.execute('DELETE FROM sync_state WHERE updated_at < ?', (now - SYNC_STATE_RETENTION_SECONDS,))
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_sync_state_store():
+    """Retorna o armazenamento de page tokens compartilhado pelo processo"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = SyncStateStore()
+        return _default_store
+
+
+def drive_user_id(service):
+    """permissionId do usuário do Drive: não muda entre logins, ao contrário do refresh token"""
+    about = service.about().get(fields='user(permissionId)').execute()
+    return about['user']['permissionId']
+
+
+class FolderSync:
+    """Sincronização incremental de uma pasta: só converte arquivos novos ou alterados
+
+    state_key identifica o page token salvo; como a Changes API é por usuário, deve incluir um
+    identificador estável do usuário (veja drive_user_id) além da pasta (padrão: só a pasta).
+    """
+
+    def __init__(self, service, folder_id, state_key=None, store=None):
+        self.service = service
+        self.folder_id = folder_id
+        self.state_key = state_key or folder_id
+        self.store = store or get_sync_state_store()
+        self._new_page_token = None
+
+    def _list(self, query, fields):
+        files = []
+        page_token = None
+        while True:
+            response = self.service.files().list(
+                q=query,
+                spaces='drive',
+                fields=f'nextPageToken, files({fields})',
+                pageSize=1000,
+                pageToken=page_token
+            ).execute()
+            files.extend(response.get('files', []))
+            page_token = response.get('nextPageToken', None)
+            if page_token is None:
+                break
+        return files
+
+    def _list_sources(self):
+        query = (
+            f"('{self.folder_id}' in parents) and "
+            "("
+            f"mimeType='{DOCX_MIME_TYPE}' or "
+            f"mimeType='{GOOGLE_DOC_MIME_TYPE}'"
+            ") and trashed=false"
+        )
+        return [f for f in self._list(query, SOURCE_FIELDS) if not is_output(f)]
+
+    def _outputs_query(self, source_id=None):
+        query = (
+            f"('{self.folder_id}' in parents) and trashed=false and "
+            f"appProperties has {{ key='{OUTPUT_MARKER_KEY}' and value='{OUTPUT_MARKER_VALUE}' }}"
+        )
+        if source_id:
+            query += f" and appProperties has {{ key='converterSource' and value='{source_id}' }}"
+        return query
+
+    def _list_outputs(self):
+        return self._list(self._outputs_query(), OUTPUT_FIELDS)
+
+    def _find_outputs(self, sources):
+        """Saídas já existentes dos arquivos alterados, buscadas em lotes HTTP"""
+        requests = [
+            self.service.files().list(
+                q=self._outputs_query(source['id']),
+                spaces='drive',
+                fields=f'files({OUTPUT_FIELDS})',
+                pageSize=10
+            )
+            for source in sources
+        ]
+        outputs = {}
+        for source, (response, error) in zip(sources, batch_execute(self.service, requests)):
+            if error:
+                raise error
+            files = response.get('files', [])
+            if files:
+                outputs[source['id']] = files[0]
+        return outputs
+
+    def _changed_sources(self, page_token):
+        """Arquivos da pasta alterados desde o page token salvo"""
+        changed = {}
+        while page_token:
+            response = self.service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                pageSize=1000,
+                fields=f'nextPageToken, newStartPageToken, changes(fileId, removed, file({SOURCE_FIELDS}))'
+            ).execute()
+            for change in response.get('changes', []):
+                file = change.get('file')
+                if change.get('removed') or not file or file.get('trashed'):
+                    changed.pop(change.get('fileId'), None)
+                    continue
+                if (self.folder_id in (file.get('parents') or [])
+                        and file.get('mimeType') in SOURCE_MIME_TYPES and not is_output(file)):
+                    changed[file['id']] = file
+            page_token = response.get('nextPageToken')
+            if 'newStartPageToken' in response:
+                self._new_page_token = response['newStartPageToken']
+        return list(changed.values())
+
+    def plan(self):
+        """Retorna os arquivos a converter, com 'output_id' quando já existe uma saída a atualizar"""
+        saved_token = self.store.get_page_token(self.state_key)
+
+        if saved_token:
+            sources = self._changed_sources(saved_token)
+            print(f"folder_sync: {len(sources)} arquivos alterados desde a última sincronização")
+            outputs = self._find_outputs(sources)
+        else:
+            # Primeira sincronização: guarda o token antes de listar para não perder alterações
+            self._new_page_token = self.service.changes().getStartPageToken().execute().get('startPageToken')
+            sources = self._list_sources()
+            outputs = {}
+            for output in self._list_outputs():
+                outputs[output['appProperties'].get('converterSource')] = output
+            print(f"folder_sync: {len(sources)} arquivos na pasta, {len(outputs)} já convertidos")
+
+        pending = []
+        for source in sources:
+            output = outputs.get(source['id'])
+            if output and is_up_to_date(source, output):
+                continue
+            file = dict(source)
+            file['output_name'] = f"{os.path.splitext(source['name'])[0]}_formatado.docx"
+            if output:
+                file['output_id'] = output['id']
+            pending.append(file)
+        return pending
+
+    def commit(self):
+        """Salva o page token depois de uma sincronização sem falhas"""
+        if not self._new_page_token:
+            return
+        self.store.save_page_token(self.state_key, self._new_page_token)
@@ -0,0 +1,258 @@
+import os
+import re
+import json
+import bisect
+import threading
+from collections import namedtuple
+
+from inline_markdown import Segment, tokenize_inline, is_plain, slice_segments
+
+# Tipos de linha reconhecidos pelo classificador
+TITLE, FIELD, SECTION, BULLET, TEXT = 'title', 'field', 'section', 'bullet', 'text'
+KINDS = (TITLE, FIELD, SECTION, BULLET, TEXT)
+
+# Linha classificada: 'label' é o trecho em negrito (com ':') e 'value' o texto que segue;
+# value=None indica que não há run depois do rótulo. Em perfis com formatação inline, 'inline' traz os
+# segmentos (texto, negrito, itálico) que substituem value (ou text, sem rótulo); None se não há formatação.
+LineRecord = namedtuple('LineRecord', ['kind', 'text', 'label', 'value', 'indent', 'inline'], defaults=(None,))
+
+# Remove asteriscos duplicados do markdown
+BOLD_MARKDOWN_PATTERN = re.compile(r'\*\*(.*?)\*\*')
+
+# Perfil padrão: as regras dos relatórios terapêuticos, na ordem em que são testadas.
+# Condições de cada regra: 'upper' (linha em maiúsculas), 'colon' (tem ':'), 'bullet' (começa com
+# marcador), 'min_length' e 'max_length'; condições ausentes aceitam qualquer linha.
+DEFAULT_PROFILE_NAME = 'relatorio'
+DEFAULT_PROFILE = {
+    'name': DEFAULT_PROFILE_NAME,
+    'strip_bold_markdown': True,
+    'bullet_markers': ['-', '•'],
+    'rules': [
+        # Título principal (linha em maiúsculas longa)
+        {'kind': TITLE, 'upper': True, 'min_length': 11},
+        # Campos com dois pontos (ex: "NOME DO PARTICIPANTE:")
+        {'kind': FIELD, 'colon': True, 'bullet': False},
+        # Seções principais (ex: "FONOAUDIOLOGIA")
+        {'kind': SECTION, 'upper': True, 'colon': False},
+        # Lista com marcadores; itens com estes prefixos têm o rótulo em negrito
+        {'kind': BULLET, 'bullet': True,
+         'bold_prefixes': ['metas terapêuticas', 'objetivos terapêuticos', 'observações']},
+        # Texto normal, recuado dentro das seções de observações
+        {'kind': TEXT, 'indent_in_sections': ['OBSERVAÇÕES']},
+    ],
+}
+
+# Mesmas regras, com **negrito**, *itálico* e _itálico_ dentro das linhas aplicados como formatação
+# (o perfil padrão só remove os asteriscos)
+INLINE_PROFILE_NAME = 'relatorio-formatado'
+INLINE_PROFILE = dict(DEFAULT_PROFILE, name=INLINE_PROFILE_NAME, inline_formatting=True)
+
+# Perfis adicionais em JSON (um objeto ou uma lista de objetos no formato de DEFAULT_PROFILE)
+FORMATTING_PROFILES_PATH = os.environ.get('FORMATTING_PROFILES_PATH')
+# Perfil usado quando o chamador não escolhe um
+FORMATTING_PROFILE = os.environ.get('FORMATTING_PROFILE', DEFAULT_PROFILE_NAME)
+# Linhas distintas guardadas por perfil; ao encher, a memória é descartada e recomeça.
+# Só linhas curtas (rótulos, seções, itens de modelo) são guardadas: parágrafos longos raramente se repetem.
+MEMO_MAX_LINES = int(os.environ.get('FORMATTING_MEMO_MAX_LINES', 16384))
+MEMO_MAX_LINE_LENGTH = 256
+
+_CONDITIONS = ('upper', 'colon', 'bullet', 'min_length', 'max_length')
+_RULE_OPTIONS = {BULLET: ('bold_prefixes',), TEXT: ('indent_in_sections',)}
+
+
+class CompiledProfile:
+    """Perfil de regras compilado em uma tabela de despacho
+
+    Cada linha é reduzida a quatro características (maiúsculas, dois pontos, marcador e faixa de
+    tamanho); a regra de cada combinação é resolvida na compilação, então classificar uma linha é uma
+    única consulta à tabela, sem testar as regras uma a uma. Linhas repetidas (comuns em relatórios
+    feitos a partir de modelos) vêm da memória do perfil.
+    """
+
+    def __init__(self, profile):
+        self.name = profile['name']
+        self.strip_bold_markdown = profile.get('strip_bold_markdown', True)
+        # Formatação inline substitui a remoção dos asteriscos: as regras veem o texto sem os marcadores
+        self.inline_formatting = profile.get('inline_formatting', False)
+        self.bullet_markers = tuple(profile.get('bullet_markers') or ())
+        self.bullet_strip = ''.join(self.bullet_markers) + ' '
+        rules = profile['rules']
+        for rule in rules:
+            if rule.get('kind') not in KINDS:
+                raise ValueError(f"Perfil {self.name}: tipo de regra desconhecido: {rule.get('kind')}")
+            unknown = set(rule) - {'kind'} - set(_CONDITIONS) - set(_RULE_OPTIONS.get(rule['kind'], ()))
+            if unknown:
+                raise ValueError(f"Perfil {self.name}: opções desconhecidas na regra {rule['kind']}: {sorted(unknown)}")
+        self.indent_sections = ()
+        for rule in rules:
+            if rule['kind'] == TEXT:
+                self.indent_sections = tuple(s.upper() for s in rule.get('indent_in_sections') or ())
+        # Limites de tamanho que mudam o resultado de alguma regra
+        bounds = set()
+        for rule in rules:
+            if 'min_length' in rule:
+                bounds.add(rule['min_length'])
+            if 'max_length' in rule:
+                bounds.add(rule['max_length'] + 1)
+        self.length_bounds = sorted(bounds)
+        self.table = {}
+        for upper in (False, True):
+            for colon in (False, True):
+                for bullet in (False, True):
+                    for bucket in range(len(self.length_bounds) + 1):
+                        length = self.length_bounds[bucket - 1] if bucket else 0
+                        rule = self._resolve(rules, upper, colon, bullet, length) or {'kind': TEXT}
+                        # (tipo, prefixes em negrito) já prontos para a classificação
+                        prefixes = tuple(p.lower() for p in rule.get('bold_prefixes') or ())
+                        self.table[upper, colon, bullet, bucket] = (rule['kind'], prefixes)
+        self._memo = {}
+        self._memo_indented = {}
+
+    @staticmethod
+    def _resolve(rules, upper, colon, bullet, length):
+        features = {'upper': upper, 'colon': colon, 'bullet': bullet}
+        for rule in rules:
+            if any(name in rule and rule[name] != features[name] for name in features):
+                continue
+            if length < rule.get('min_length', 0) or length > rule.get('max_length', length):
+                continue
+            return rule
+        return None
+
+    def _classify_line(self, line):
+        """Registro da linha sem o estado da seção (TEXT sai sem recuo), ou None para linhas ignoradas"""
+        if self.inline_formatting:
+            segments = tokenize_inline(line)
+            line = ''.join(segment.text for segment in segments)
+            if not is_plain(segments):
+                return self._classify_formatted(line, segments)
+        elif self.strip_bold_markdown and '**' in line:
+            line = BOLD_MARKDOWN_PATTERN.sub(r'\1', line)
+        return self._classify_text(line)
+
+    def _classify_text(self, line):
+        key = (line.isupper(), ':' in line, line.startswith(self.bullet_markers),
+               bisect.bisect_right(self.length_bounds, len(line)))
+        kind, bold_prefixes = self.table[key]
+        if kind == FIELD:
+            label, value = line.split(':', 1)
+            value = value.strip()
+            return LineRecord(FIELD, line, label.strip() + ':', ' ' + value if value else None, False)
+        if kind == BULLET:
+            text = line.lstrip(self.bullet_strip).strip()
+            if not text:
+                return None  # pula marcadores vazios
+            # Negrito para itens especiais
+            if text.lower().startswith(bold_prefixes):
+                parts = text.split(':', 1)
+                return LineRecord(BULLET, text, parts[0] + ':', parts[1] if len(parts) > 1 else None, False)
+            return LineRecord(BULLET, text, None, None, False)
+        return LineRecord(kind, line, None, None, False)
+
+    def _classify_formatted(self, line, segments):
+        """Como _classify_line, para uma linha com formatação inline (line é o texto visível)"""
+        record = self._classify_text(line)
+        if record is None:
+            return None
+        kind = record.kind
+        if kind == FIELD:
+            if record.value is None:
+                return record
+            start = line.index(':') + 1
+            start += len(line[start:]) - len(line[start:].lstrip())
+            # value é ' ' + o texto depois dos dois pontos
+            inline = _inline_part(segments, start, start + len(record.value) - 1)
+            if inline is not None:
+                # O espaço depois do rótulo é texto simples: entra no primeiro trecho só se ele também for
+                # simples, sem herdar o negrito ou itálico do valor
+                first = inline[0]
+                if first.bold or first.italic:
+                    inline = (Segment(' ', False, False),) + inline
+                else:
+                    inline = (first._replace(text=' ' + first.text),) + inline[1:]
+            return record._replace(inline=inline)
+        if kind == BULLET:
+            rest = line.lstrip(self.bullet_strip)
+            start = len(line) - len(rest.lstrip())
+            if record.label is None:
+                return record._replace(inline=_inline_part(segments, start, start + len(record.text)))
+            if not record.value:
+                return record
+            start += len(record.label)
+            return record._replace(inline=_inline_part(segments, start, start + len(record.value)))
+        return record._replace(inline=segments)
+
+    def classify(self, markdown_text):
+        """Classifica as linhas do texto em registros tipados, em uma única passada"""
+        memo = self._memo
+        memo_indented = self._memo_indented
+        indent_sections = self.indent_sections
+        indent = False
+        for line in markdown_text.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            record = memo.get(line)
+            if record is None:
+                record = self._classify_line(line)
+                if len(line) <= MEMO_MAX_LINE_LENGTH:
+                    if len(memo) >= MEMO_MAX_LINES:
+                        memo.clear()
+                        memo_indented.clear()
+                    memo[line] = record
+            if record is None:
+                continue
+            kind = record.kind
+            if kind == SECTION:
+                # A seção atual é o único estado entre linhas: define o recuo do texto que segue
+                section = record.text.upper()
+                indent = any(name in section for name in indent_sections)
+            elif kind == TEXT and indent:
+                indented = memo_indented.get(line)
+                if indented is None:
+                    indented = memo_indented[line] = record._replace(indent=True)
+                record = indented
+            yield record
+
+
+def _inline_part(segments, start, end):
+    """Segmentos do trecho [start, end) do texto visível, ou None se o trecho não tem formatação"""
+    part = slice_segments(segments, start, end)
+    return None if is_plain(part) else part
+
+
+_profiles = {DEFAULT_PROFILE_NAME: DEFAULT_PROFILE, INLINE_PROFILE_NAME: INLINE_PROFILE}
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def register_profile(profile):
+    """Registra (ou substitui) um perfil de regras"""
+    CompiledProfile(profile)  # valida antes de registrar
+    with _compiled_lock:
+        _profiles[profile['name']] = profile
+        _compiled.pop(profile['name'], None)
+
+
+def load_profiles(path):
+    """Registra os perfis de um arquivo JSON"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    for profile in data if isinstance(data, list) else [data]:
+        register_profile(profile)
+
+
+def get_profile(name=None):
+    """Perfil compilado pelo nome (FORMATTING_PROFILE por padrão), compilado uma vez por processo"""
+    name = name or FORMATTING_PROFILE
+    with _compiled_lock:
+        compiled = _compiled.get(name)
+        if compiled is None:
+            if name not in _profiles:
+                raise ValueError(f"Perfil de formatação desconhecido: {name}")
+            compiled = _compiled[name] = CompiledProfile(_profiles[name])
+        return compiled
+
+
+if FORMATTING_PROFILES_PATH:
+    load_profiles(FORMATTING_PROFILES_PATH)
@@ -1,20 +1,180 @@
+import os
+import random
+import time
 import tempfile
+from functools import partial
+
+from metrics import BYTES
+
+DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+GOOGLE_DOC_MIME_TYPE = 'application/vnd.google-apps.document'
+TEXT_MIME_TYPE = 'text/plain'
+
+# Formato de exportação dos Google Docs: 'text' (texto simples, sem gerar e reler um .docx) ou 'docx'.
+# Para conferir se os parágrafos batem nos documentos reais, veja export_parity.py.
+GOOGLE_DOC_EXPORT = os.environ.get('GOOGLE_DOC_EXPORT', 'text')
+
+# Limite de requisições por lote HTTP da API do Drive
+BATCH_MAX_REQUESTS = 100
+
+# Downloads até este tamanho ficam só em memória; acima disso vão para um arquivo temporário
+SPOOL_MAX_BYTES = int(os.environ.get('CONVERTER_SPOOL_MAX_BYTES', 32 * 1024 * 1024))
+
+# Tamanho de cada pedaço transferido (uploads exigem múltiplo de 256 KB)
+DRIVE_CHUNK_SIZE = int(os.environ.get('DRIVE_CHUNK_SIZE', 8 * 1024 * 1024))
+# Uploads acima deste tamanho usam sessão resumível; abaixo, uma única requisição multipart
+RESUMABLE_THRESHOLD = int(os.environ.get('DRIVE_RESUMABLE_THRESHOLD', 5 * 1024 * 1024))
+# Tentativas da biblioteca em cada requisição (com backoff exponencial), só em transportes sem o
+# escalonador: o ScheduledHttp já repete limitações, erros 5xx e falhas de conexão
+DRIVE_CHUNK_RETRIES = int(os.environ.get('DRIVE_CHUNK_RETRIES', 5))
+# Retomadas de um upload resumível, do último byte confirmado, após falha de um pedaço (pedaços em stream
+# não podem ser reenviados pelo transporte)
+DRIVE_RESUME_ATTEMPTS = int(os.environ.get('DRIVE_RESUME_ATTEMPTS', 3))
+DRIVE_RESUME_BACKOFF = float(os.environ.get('DRIVE_RESUME_BACKOFF', 1.0))
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+def is_transient_error(e):
+    """Indica se a falha é passageira (limite de taxa, erro do servidor ou de conexão)"""
+    import httplib2
+    from googleapiclient.errors import HttpError
+    if isinstance(e, HttpError):
+        return e.resp.status in RETRYABLE_STATUS
+    return isinstance(e, (OSError, httplib2.HttpLib2Error))
+
+
+def library_retries(http):
+    """num_retries das chamadas da biblioteca: 0 sobre o ScheduledHttp, que já faz as novas tentativas"""
+    from drive_scheduler import ScheduledHttp
+    # O transporte pode estar dentro do AuthorizedHttp da google-auth-httplib2
+    for _ in range(3):
+        if isinstance(http, ScheduledHttp):
+            return 0
+        http = getattr(http, 'http', None)
+    return DRIVE_CHUNK_RETRIES
+
+
+def _upload_chunks(request, num_retries):
+    """Envia os pedaços do upload resumível, retomando do último byte confirmado após falhas transitórias
+
+    Sobre o ScheduledHttp é aqui que os pedaços são repetidos: o corpo em stream não pode ser reenviado
+    pelo transporte, e a sessão pergunta ao Drive quanto já chegou antes de continuar.
+    """
+    failures = 0
+    while True:
+        try:
+            status, response = request.next_chunk(num_retries=num_retries)
+        except Exception as e:
+            if num_retries or failures >= DRIVE_RESUME_ATTEMPTS or not is_transient_error(e):
+                raise
+            failures += 1
+            delay = DRIVE_RESUME_BACKOFF * (2 ** (failures - 1)) * (1 + random.random())
+            print(f"google_drive_integration: Falha transitória no upload ({e}); retomando em {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        failures = 0
+        if response is not None:
+            return response
+
+
+def media_for_upload(fh, mimetype=DOCX_MIME_TYPE):
+    """Mídia para upload: resumível em pedaços para arquivos grandes, multipart para os pequenos"""
+    from googleapiclient.http import MediaIoBaseUpload
+    fh.seek(0, os.SEEK_END)
+    size = fh.tell()
+    fh.seek(0)
+    if size > RESUMABLE_THRESHOLD:
+        return MediaIoBaseUpload(fh, mimetype=mimetype, chunksize=DRIVE_CHUNK_SIZE, resumable=True)
+    return MediaIoBaseUpload(fh, mimetype=mimetype, resumable=False)
+
+
+def execute_upload(request):
+    """Executa um create/update com mídia e devolve a resposta
+
+    Uploads resumíveis seguem pedaço a pedaço; após uma falha a sessão consulta o servidor e continua do último byte recebido.
+    """
+    num_retries = library_retries(request.http)
+    if not request.resumable:
+        response = request.execute(num_retries=num_retries)
+    else:
+        response = _upload_chunks(request, num_retries)
+    # Sem sessão resumível, a mídia vai no corpo multipart da própria requisição
+    BYTES.inc(request.resumable.size() if request.resumable else (request.body_size or 0), direction='upload')
+    return response
+
+
+def is_text_export(mime_type):
+    """True se o arquivo é baixado como texto (Google Docs com GOOGLE_DOC_EXPORT=text) em vez de .docx"""
+    return mime_type == GOOGLE_DOC_MIME_TYPE and GOOGLE_DOC_EXPORT == 'text'
+
+
+def export_mime_type(mime_type):
+    """Formato pedido ao Drive no download do arquivo (só vale para Google Docs, que são exportados)"""
+    return TEXT_MIME_TYPE if is_text_export(mime_type) else DOCX_MIME_TYPE
+
+
+def decode_exported_text(data):
+    """Texto de uma exportação text/plain com a mesma divisão em linhas do caminho .docx
+
+    A exportação vem com BOM e quebras \\r\\n; quebras dentro do parágrafo (Shift+Enter) podem vir como
+    \\x0b, que no .docx viram '\\n'.
+    """
+    text = data.decode('utf-8-sig')
+    return text.replace('\r\n', '\n').replace('\r', '\n').replace('\x0b', '\n')
+
+
+def download_drive_file(service, file_id, mime_type=None, fh=None, export_as=DOCX_MIME_TYPE):
+    """Baixa um arquivo do Google Drive e retorna o buffer posicionado no início
+
+    Google Docs são exportados no formato export_as (.docx por padrão); os demais arquivos são baixados como estão.
+    O download é feito em pedaços de DRIVE_CHUNK_SIZE. Sem fh, usa um buffer que só é gravado em disco acima de SPOOL_MAX_BYTES.
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+    if mime_type == GOOGLE_DOC_MIME_TYPE:
+        request = service.files().export_media(fileId=file_id, mimeType=export_as)
+    else:
+        request = service.files().get_media(fileId=file_id)
+    if fh is None:
+        fh = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, suffix='.docx')
+    downloader = MediaIoBaseDownload(fh, request, chunksize=DRIVE_CHUNK_SIZE)
+    # Cada pedaço é um GET reenviável: as novas tentativas ficam no transporte (ou na biblioteca, sem o escalonador)
+    num_retries = library_retries(request.http)
+    done = False
+    while not done:
+        status, done = downloader.next_chunk(num_retries=num_retries)
+    BYTES.inc(fh.tell(), direction='download')
+    fh.seek(0)
+    return fh
+
+
+def batch_execute(service, requests):
+    """Executa requisições sem mídia em lotes HTTP do Drive
+
+    Retorna, na ordem das requisições, uma lista de pares (resposta, exceção).
+    """
+    results = [(None, None)] * len(requests)
+
+    def callback(index, request_id, response, exception):
+        results[index] = (response, exception)
+
+    for start in range(0, len(requests), BATCH_MAX_REQUESTS):
+        batch = service.new_batch_http_request()
+        for index, request in enumerate(requests[start:start + BATCH_MAX_REQUESTS], start):
+            batch.add(request, callback=partial(callback, index))
+        batch.execute()
+    return results
+
 
 def process_drive_file(service, file_id):
     # Baixa o arquivo do Google Drive como .docx e retorna caminho e nome
-    request = service.files().get_media(fileId=file_id)
+    # Os metadados vêm antes do download: o tipo decide entre exportar (Google Docs) e baixar direto
+    file_metadata = service.files().get(fileId=file_id, fields='id,name,mimeType').execute()
+    filename = file_metadata.get('name', 'documento.docx')
     fh = tempfile.NamedTemporaryFile(delete=False, suffix='.docx')
-    downloader = None
     try:
-        from googleapiclient.http import MediaIoBaseDownload
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
+        download_drive_file(service, file_id, file_metadata.get('mimeType'), fh=fh)
         fh.close()
-        # Recupera nome do arquivo
-        file_metadata = service.files().get(fileId=file_id).execute()
-        filename = file_metadata.get('name', 'documento.docx')
         return fh.name, filename
     except Exception as e:
         if fh:
@@ -0,0 +1,28 @@
+# Configuração do gunicorn (lida automaticamente do diretório atual por "gunicorn app:app")
+import gc
+import os
+
+# Importa o app uma vez no processo mestre: os workers nascem por fork com os módulos já carregados
+# (copy-on-write), em vez de cada um pagar as centenas de ms de importação antes de atender.
+# GUNICORN_PRELOAD=0 volta a importar em cada worker (ex: para recarregar o código com --reload).
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    import app
+    app.warm_up()
+    # Tira os objetos já carregados do coletor de lixo: sem isso, cada coleta nos workers toca as
+    # páginas herdadas e elas deixam de ser compartilhadas
+    gc.freeze()
+    server.log.info("Aplicação pré-carregada no processo mestre")
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return  # sem preload, cada worker cria a fila (e recupera os jobs) ao importar o app
+    # Com preload a fila foi criada no mestre: cada worker novo (ex: um reciclado) encerra os jobs
+    # que ficaram em andamento nos workers que já morreram
+    import app
+    app.job_queue.recover()
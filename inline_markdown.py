@@ -0,0 +1,111 @@
+import re
+from collections import namedtuple
+
+# Trecho da linha com a mesma formatação
+Segment = namedtuple('Segment', ['text', 'bold', 'italic'])
+
+# Escape (\*, \_ ou \\) ou sequência de delimitadores
+_TOKEN = re.compile(r'\\([\\*_])|(\*+|_+)')
+
+
+def tokenize_inline(text):
+    """Divide a linha em segmentos (texto, negrito, itálico), em uma única passada
+
+    Reconhece **negrito**, *itálico* e _itálico_, aninhados em qualquer ordem, e os escapes \\*, \\_ e \\\\.
+    Um delimitador só abre antes de um caractere que não é espaço e só fecha depois de um; '_' entre
+    letras (ex: nome_do_arquivo) é texto. Delimitadores sem par ficam como texto. Cada caractere é
+    visitado um número constante de vezes, mesmo em linhas longas cheias de asteriscos.
+    """
+    if '*' not in text and '_' not in text and '\\' not in text:
+        return (Segment(text, False, False),)
+    # Peças na ordem da linha: [texto, variação do negrito, variação do itálico]
+    pieces = []
+    # Delimitadores abertos, do mais externo ao mais interno: (índice da peça, delimitador, sequência)
+    stack = []
+    # Posições na pilha dos abertos de cada delimitador
+    positions = {'**': [], '*': [], '__': [], '_': []}
+    position = 0
+    for run_id, match in enumerate(_TOKEN.finditer(text)):
+        if match.start() > position:
+            pieces.append([text[position:match.start()], 0, 0])
+        position = match.end()
+        if match.group(1):
+            pieces.append([match.group(1), 0, 0])
+            continue
+        run = match.group(2)
+        char = run[0]
+        before = text[match.start() - 1] if match.start() else ' '
+        after = text[match.end()] if match.end() < len(text) else ' '
+        can_open = not after.isspace() and not (char == '_' and before.isalnum())
+        can_close = not before.isspace() and not (char == '_' and after.isalnum())
+        remaining = len(run)
+        while remaining:
+            # Fecha o delimitador aberto mais interno deste caractere, se houver (e não for desta sequência)
+            closing = None
+            if can_close:
+                for delimiter in (char * 2, char):
+                    opened = positions[delimiter]
+                    if opened and len(delimiter) <= remaining and stack[opened[-1]][2] != run_id:
+                        if closing is None or opened[-1] > closing:
+                            closing = opened[-1]
+            if closing is not None:
+                index, delimiter, _ = stack[closing]
+                # Os abertos depois dele ficam sem par: continuam como texto
+                for _, inner, _ in stack[closing + 1:]:
+                    positions[inner].pop()
+                del stack[closing:]
+                positions[delimiter].pop()
+                bold, italic = (1, 0) if len(delimiter) == 2 else (0, 1)
+                pieces[index][:] = ['', bold, italic]
+                pieces.append(['', -bold, -italic])
+                remaining -= len(delimiter)
+            elif can_open:
+                delimiter = char * min(remaining, 2)
+                positions[delimiter].append(len(stack))
+                stack.append((len(pieces), delimiter, run_id))
+                pieces.append([delimiter, 0, 0])
+                remaining -= len(delimiter)
+            else:
+                pieces.append([char * remaining, 0, 0])
+                remaining = 0
+    if position < len(text):
+        pieces.append([text[position:], 0, 0])
+
+    segments = []
+    bold = italic = 0
+    buffer, buffer_style = [], None
+    for piece_text, bold_change, italic_change in pieces:
+        if bold_change or italic_change:
+            bold += bold_change
+            italic += italic_change
+        elif piece_text:
+            style = (bold > 0, italic > 0)
+            # Trechos vizinhos com a mesma formatação (ex: **a****b**) ficam em um só segmento
+            if buffer and style != buffer_style:
+                segments.append(Segment(''.join(buffer), *buffer_style))
+                buffer = []
+            buffer_style = style
+            buffer.append(piece_text)
+    if buffer:
+        segments.append(Segment(''.join(buffer), *buffer_style))
+    return tuple(segments)
+
+
+def is_plain(segments):
+    """True se os segmentos não têm negrito nem itálico (no máximo um trecho de texto simples)"""
+    return len(segments) <= 1 and not any(s.bold or s.italic for s in segments)
+
+
+def slice_segments(segments, start, end):
+    """Segmentos do trecho [start, end) do texto visível (a concatenação dos segmentos)"""
+    result = []
+    offset = 0
+    for segment in segments:
+        length = len(segment.text)
+        if offset + length > start and offset < end:
+            piece = segment.text[max(start - offset, 0):end - offset]
+            result.append(Segment(piece, segment.bold, segment.italic))
+        offset += length
+        if offset >= end:
+            break
+    return tuple(result)
@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# O estado dos jobs fica em SQLite para que qualquer worker do gunicorn responda às consultas;
+# a execução acontece no pool de threads do processo que recebeu o pedido.
+JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', os.path.join(tempfile.gettempdir(), 'converter_jobs.sqlite3'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+# No modo ASGI os jobs são corrotinas: o limite de jobs simultâneos pode ser bem maior
+ASYNC_MAX_JOBS = int(os.environ.get('ASYNC_MAX_JOBS', 256))
+# Jobs concluídos há mais tempo que isso são removidos do banco
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 24 * 3600))
+# Erro registrado nos jobs interrompidos junto com o processo que os executava
+ORPHANED_JOB_ERROR = 'Job interrompido: o processo que o executava foi encerrado (ex: worker reiniciado). Envie novamente.'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT,
+    total INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    worker_pid INTEGER,
+    worker_started TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    name TEXT,
+    status TEXT NOT NULL,
+    stage TEXT,
+    link TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, file_id)
+);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at);
+"""
+
+
+class JobStore:
+    """Persistência do estado dos jobs e do progresso por arquivo em SQLite"""
+
+    def __init__(self, path=None):
+        self.path = path or JOBS_DB_PATH
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Bancos criados antes das colunas worker_pid e worker_started
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, kind in (('worker_pid', 'INTEGER'), ('worker_started', 'TEXT')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # Uma conexão aberta antes do fork (gunicorn com preload) não pode ser usada pelo processo filho
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create_job(self, kind, owner, params=None):
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, owner, status, params, worker_pid, worker_started, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, owner, 'queued', json.dumps(params or {}), os.getpid(), _process_started(os.getpid()),
+                 time.time())
+            )
+        return job_id
+
+    def start_job(self, job_id):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status='running', worker_pid=?, worker_started=?, started_at=? WHERE id=?",
+                (os.getpid(), _process_started(os.getpid()), time.time(), job_id)
+            )
+
+    def set_files(self, job_id, files):
+        """Registra os arquivos que o job vai processar"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO job_files (job_id, file_id, name, status, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+                [(job_id, f['id'], f.get('name'), now) for f in files]
+            )
+            conn.execute(
+                'UPDATE jobs SET total=(SELECT COUNT(*) FROM job_files WHERE job_id=?) WHERE id=?',
+                (job_id, job_id)
+            )
+
+    def file_done(self, job_id, result):
+        """Registra o resultado de um arquivo (sucesso ou erro)"""
+        column = 'done' if result['status'] == 'ok' else 'failed'
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE job_files SET name=COALESCE(?, name), status=?, stage=?, link=?, error=?, updated_at=? '
+                'WHERE job_id=? AND file_id=?',
+                (result.get('name'), result['status'], result.get('stage'), result.get('link'), result.get('error'),
+                 time.time(), job_id, result['id'])
+            )
+            conn.execute(f'UPDATE jobs SET {column}={column}+1 WHERE id=?', (job_id,))
+
+    def finish_job(self, job_id, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET status=?, error=?, finished_at=? WHERE id=?',
+                ('error' if error else 'finished', error, time.time(), job_id)
+            )
+
+    def fail_orphaned(self):
+        """Encerra com erro os jobs na fila ou em execução de processos que não existem mais
+
+        Os jobs rodam no processo que os recebeu: quando o worker é reciclado ou morre, eles ficariam
+        'queued'/'running' para sempre. Jobs de processos vivos (outros workers) não são tocados; o
+        início do processo gravado junto com o pid distingue o worker de outro processo que reusou o pid.
+        """
+        conn = self._connect()
+        now = time.time()
+        # BEGIN IMMEDIATE: dois workers iniciando juntos não encerram (e contam) o mesmo job duas vezes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                "SELECT id, worker_pid, worker_started FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+            orphaned = [row['id'] for row in rows if not _process_alive(row['worker_pid'], row['worker_started'])]
+            for job_id in orphaned:
+                pending = conn.execute(
+                    "UPDATE job_files SET status='error', error=?, updated_at=? WHERE job_id=? AND status='pending'",
+                    (ORPHANED_JOB_ERROR, now, job_id)
+                ).rowcount
+                conn.execute(
+                    "UPDATE jobs SET status='error', error=?, failed=failed+?, finished_at=? WHERE id=?",
+                    (ORPHANED_JOB_ERROR, pending, now, job_id)
+                )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if orphaned:
+            print(f"jobs: {len(orphaned)} jobs interrompidos de processos encerrados marcados como erro")
+        return len(orphaned)
+
+    def get_job(self, job_id, owner=None):
+        """Retorna o job com progresso, ETA e resultados por arquivo"""
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM jobs WHERE id=?', (job_id,)).fetchone()
+        if row is None or (owner is not None and row['owner'] != owner):
+            return None
+        files = conn.execute(
+            'SELECT file_id, name, status, stage, link, error FROM job_files WHERE job_id=? ORDER BY rowid',
+            (job_id,)
+        ).fetchall()
+        return self._to_dict(row, files)
+
+    def list_jobs(self, owner, limit=20):
+        conn = self._connect()
+        rows = conn.execute(
+            'SELECT * FROM jobs WHERE owner=? ORDER BY created_at DESC LIMIT ?', (owner, limit)
+        ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def purge(self, max_age=None):
+        """Remove jobs concluídos antigos"""
+        cutoff = time.time() - (max_age or JOB_RETENTION_SECONDS)
+        with self._connect() as conn:
+            conn.execute(
+                'DELETE FROM job_files WHERE job_id IN (SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?)',
+                (cutoff,)
+            )
+            conn.execute('DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?', (cutoff,))
+
+    @staticmethod
+    def _to_dict(row, files=None):
+        processed = row['done'] + row['failed']
+        eta = None
+        if row['status'] == 'running' and row['started_at'] and processed and row['total'] > processed:
+            elapsed = time.time() - row['started_at']
+            eta = round(elapsed / processed * (row['total'] - processed), 1)
+        job = {
+            'id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'params': json.loads(row['params'] or '{}'),
+            'total': row['total'],
+            'done': row['done'],
+            'failed': row['failed'],
+            'progress': round(100.0 * processed / row['total'], 1) if row['total'] else 0.0,
+            'eta_seconds': eta,
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+        }
+        if files is not None:
+            job['files'] = [dict(f) for f in files]
+        return job
+
+
+def _process_started(pid):
+    """Boot e instante de início do processo (/proc), ou None onde não há /proc
+
+    O pid sozinho não identifica o processo: depois de um reinício da máquina ou de muitos processos
+    ele pode pertencer a outro programa.
+    """
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            boot_id = f.read().strip()
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # O nome do comando (2º campo) pode ter espaços e parênteses; starttime é o 22º campo
+    return f"{boot_id}:{stat.rsplit(')', 1)[1].split()[19]}"
+
+
+def _process_alive(pid, started=None):
+    """Se o processo existe nesta máquina (jobs sem pid são de antes da coluna: considerados encerrados)
+
+    Com started (de _process_started), o processo com esse pid também precisa ter começado no mesmo instante.
+    """
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return started is None or _process_started(pid) in (started, None)
+
+
+class Job:
+    """Visão de um job em execução, usada pelas funções de trabalho para reportar progresso"""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.id = job_id
+
+    def set_files(self, files):
+        self.store.set_files(self.id, files)
+
+    def file_done(self, result):
+        self.store.file_done(self.id, result)
+
+
+class JobQueue:
+    """Fila de jobs em processo, executada por um pool local de threads"""
+
+    def __init__(self, store=None, workers=None):
+        self.store = store or JobStore()
+        self._executor = ThreadPoolExecutor(max_workers=workers or JOB_WORKERS, thread_name_prefix='job')
+        self.recover()
+
+    def recover(self):
+        """Encerra os jobs deixados por processos encerrados (chamado ao iniciar cada worker)"""
+        try:
+            self.store.fail_orphaned()
+        except sqlite3.Error as e:
+            print(f"jobs: Erro ao recuperar jobs interrompidos: {e}")
+
+    def submit(self, kind, owner, func, *args, params=None):
+        """Enfileira func(job, *args) e devolve o id do job"""
+        job_id = self.store.create_job(kind, owner, params)
+        self._executor.submit(self._run, Job(self.store, job_id), func, args)
+        return job_id
+
+    def _run(self, job, func, args):
+        self.store.start_job(job.id)
+        print(f"jobs: Iniciando job {job.id}")
+        try:
+            func(job, *args)
+        except Exception as e:
+            print(f"jobs: Job {job.id} falhou: {e}")
+            self.store.finish_job(job.id, error=str(e))
+        else:
+            print(f"jobs: Job {job.id} concluído")
+            self.store.finish_job(job.id)
+        try:
+            self.store.purge()
+        except sqlite3.Error as e:
+            print(f"jobs: Erro ao limpar jobs antigos: {e}")
+
+
+class AsyncJobQueue:
+    """Fila de jobs do modo ASGI: cada job roda como corrotina no loop do servidor
+
+    handlers associa o tipo do job à sua versão assíncrona; tipos sem versão assíncrona rodam a
+    função síncrona recebida em submit numa thread.
+    """
+
+    def __init__(self, store=None, max_jobs=None, handlers=None):
+        self.store = store or JobStore()
+        self.max_jobs = max_jobs or ASYNC_MAX_JOBS
+        self.handlers = dict(handlers or {})
+        self._loop = None
+        self._slots = None
+
+    def start(self, loop):
+        """Associa a fila ao loop do servidor (chamado no startup do lifespan)"""
+        self._loop = loop
+        self._slots = asyncio.Semaphore(self.max_jobs)
+        self.recover()
+
+    def recover(self):
+        """Encerra os jobs deixados por processos encerrados (chamado no startup de cada worker)"""
+        try:
+            self.store.fail_orphaned()
+        except sqlite3.Error as e:
+            print(f"jobs: Erro ao recuperar jobs interrompidos: {e}")
+
+    def submit(self, kind, owner, func, *args, params=None):
+        """Enfileira o job no loop (pode ser chamado de qualquer thread) e devolve o id"""
+        if self._loop is None:
+            raise RuntimeError('Fila assíncrona de jobs não iniciada')
+        job_id = self.store.create_job(kind, owner, params)
+        asyncio.run_coroutine_threadsafe(self._run(Job(self.store, job_id), kind, func, args), self._loop)
+        return job_id
+
+    async def _run(self, job, kind, func, args):
+        async with self._slots:
+            # O SQLite é síncrono: as escritas de estado vão para threads, fora do loop
+            await asyncio.to_thread(self.store.start_job, job.id)
+            print(f"jobs: Iniciando job {job.id}")
+            error = None
+            try:
+                handler = self.handlers.get(kind)
+                if handler:
+                    await handler(job, *args)
+                else:
+                    await asyncio.to_thread(func, job, *args)
+            except Exception as e:
+                print(f"jobs: Job {job.id} falhou: {e}")
+                error = str(e)
+            else:
+                print(f"jobs: Job {job.id} concluído")
+            await asyncio.to_thread(self.store.finish_job, job.id, error)
+            try:
+                await asyncio.to_thread(self.store.purge)
+            except sqlite3.Error as e:
+                print(f"jobs: Erro ao limpar jobs antigos: {e}")
@@ -1,5 +1,3 @@
-import re
-import docx
 import argparse
 import os
 import sys
@@ -8,15 +6,147 @@ from docx.shared import Pt
 from docx.oxml.shared import OxmlElement
 from docx.oxml.ns import qn
 import io
+from copy import deepcopy
+from docx.text.paragraph import Paragraph
+from docx_text_extractor import extract_docx_text
+from docx_templates import new_document, template_fingerprint
+from inline_markdown import tokenize_inline
+from formatting_rules import (
+    TITLE, FIELD, SECTION, BULLET, get_profile, FORMATTING_PROFILE, DEFAULT_PROFILE_NAME
+)
+
+# Versão das regras de formatação; mude ao alterar a saída para invalidar conversões em cache
+CONVERTER_VERSION = '1'
+# Versão usada nas chaves de cache e nas saídas sincronizadas: inclui o perfil quando não é o padrão
+# (ao alterar as regras de um perfil próprio, mude o nome dele) e o conteúdo do modelo .docx próprio
+FORMAT_VERSION = '-'.join(
+    [CONVERTER_VERSION]
+    + ([FORMATTING_PROFILE] if FORMATTING_PROFILE != DEFAULT_PROFILE_NAME else [])
+    + ([f'tpl{template_fingerprint()}'] if template_fingerprint() else [])
+)
+
+# Backends de escrita do .docx: 'python-docx' monta o documento em memória,
+# 'stream' grava o XML parágrafo a parágrafo (memória constante para documentos grandes)
+DOCX_BACKENDS = ('python-docx', 'stream')
+DOCX_BACKEND = os.environ.get('DOCX_BACKEND', 'python-docx')
+
+
+def classify_lines(markdown_text, profile=None):
+    """Classifica as linhas do texto em registros tipados, em uma única passada
+
+    As regras vêm do perfil de formatação (FORMATTING_PROFILE por padrão); veja formatting_rules.
+    """
+    return get_profile(profile).classify(markdown_text)
+
+
+class DocxEmitter:
+    """Escreve registros de linha em um documento python-docx, reaproveitando estilos e formatos"""
+
+    def __init__(self, doc):
+        self.body = doc.element.body
+        self.container = doc._body
+        self.sect_pr = self.body.sectPr
+
+        # Gera uma vez, pelo próprio python-docx, as propriedades usadas em cada tipo de linha
+        # e depois só copia o XML pronto
+        scratch = doc.add_paragraph()
+        scratch.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        self.title_ppr = deepcopy(scratch._p.pPr)
+        scratch._p.remove(scratch._p.pPr)
+        scratch.style = doc.styles['List Bullet']
+        self.bullet_ppr = deepcopy(scratch._p.pPr)
+        scratch._p.remove(scratch._p.pPr)
+        scratch.paragraph_format.left_indent = Pt(20)
+        self.indent_ppr = deepcopy(scratch._p.pPr)
+        # Propriedades de run por (negrito, itálico), copiadas para cada run com a mesma formatação
+        self.run_rprs = {}
+        for bold, italic in ((True, False), (False, True), (True, True)):
+            run = scratch.add_run()
+            run.bold = bold or None
+            run.italic = italic or None
+            self.run_rprs[bold, italic] = deepcopy(run._r.rPr)
+        self.body.remove(scratch._p)
+
+    def _new_paragraph(self, ppr=None):
+        # Insere antes do sectPr final sem percorrer o corpo inteiro a cada parágrafo
+        p = OxmlElement('w:p')
+        if ppr is not None:
+            p.append(deepcopy(ppr))
+        if self.sect_pr is not None:
+            self.sect_pr.addprevious(p)
+        else:
+            self.body.append(p)
+        return p
+
+    def _add_run(self, p, text, bold=False, italic=False):
+        if '\t' in text or '\n' in text or '\r' in text:
+            # Tabulações e quebras viram elementos próprios; deixa o python-docx tratar
+            run = Paragraph(p, self.container).add_run(text)
+            if bold:
+                run.bold = True
+            if italic:
+                run.italic = True
+            return
+        r = OxmlElement('w:r')
+        if bold or italic:
+            r.append(deepcopy(self.run_rprs[bold, italic]))
+        if text:
+            t = OxmlElement('w:t')
+            t.text = text
+            if len(text.strip()) < len(text):
+                t.set(qn('xml:space'), 'preserve')
+            r.append(t)
+        p.append(r)
+
+    def _add_segments(self, p, segments, bold=False):
+        # Segmentos (texto, negrito, itálico) da formatação inline; bold força negrito em todos
+        for segment in segments:
+            self._add_run(p, segment.text, bold or segment.bold, segment.italic)
+
+    def _add_content(self, p, text, inline, bold=False):
+        if inline is not None:
+            self._add_segments(p, inline, bold)
+        else:
+            self._add_run(p, text, bold)
+
+    def emit(self, record):
+        # Os espaçamentos (space_before/space_after) nunca chegaram ao XML, por isso não são aplicados aqui
+        kind = record.kind
+        inline = record.inline
+        if kind == TITLE:
+            p = self._new_paragraph(self.title_ppr)
+            self._add_content(p, record.text, inline, bold=True)
+        elif kind == FIELD:
+            p = self._new_paragraph()
+            self._add_run(p, record.label, bold=True)
+            if record.value is not None:
+                self._add_content(p, record.value, inline)
+        elif kind == SECTION:
+            p = self._new_paragraph()
+            self._add_content(p, record.text, inline, bold=True)
+        elif kind == BULLET:
+            p = self._new_paragraph(self.bullet_ppr)
+            if record.label is not None:
+                self._add_run(p, record.label, bold=True)
+                if record.value is not None:
+                    self._add_content(p, record.value, inline)
+            else:
+                self._add_content(p, record.text, inline)
+        else:
+            p = self._new_paragraph(self.indent_ppr if record.indent else None)
+            self._add_content(p, record.text, inline)
+        return p
+
+    def emit_all(self, records):
+        for record in records:
+            self.emit(record)
+
 
 class MarkdownToDocxConverter:
     def extract_text_from_docx(self, docx_path):
-        """Extrai texto de um arquivo .docx"""
-        doc = docx.Document(docx_path)
-        text = []
-        for para in doc.paragraphs:
-            text.append(para.text)
-        return '\n'.join(text)
+        """Extrai texto de um arquivo .docx (caminho, bytes ou objeto de arquivo)"""
+        # Lê o XML em streaming, sem montar o documento inteiro no python-docx
+        return extract_docx_text(docx_path)
 
     def add_document_property(doc, name, value):
         """Adiciona uma propriedade personalizada ao documento"""
@@ -36,82 +166,28 @@ class MarkdownToDocxConverter:
             custom_prop.set(qn('cp:value'), value)
             custom_props[0].append(custom_prop)
 
-    def parse_markdown_to_docx(self, markdown_text, output_path, drive_id=None):
-        doc = docx.Document()
-
-        # Configura margens do documento
-        for section in doc.sections:
-            section.left_margin = Pt(72)
-            section.right_margin = Pt(72)
-            section.top_margin = Pt(72)
-            section.bottom_margin = Pt(72)
+    def build_document(self, markdown_text):
+        """Monta o documento python-docx formatado, sem salvar"""
+        # Cópia do modelo carregado uma vez por processo (margens já aplicadas), em vez de reabrir o pacote
+        doc = new_document()
+        DocxEmitter(doc).emit_all(classify_lines(markdown_text))
+        return doc
 
-        lines = markdown_text.split('\n')
-        current_section = None
+    def parse_markdown_to_docx(self, markdown_text, output_path, drive_id=None, backend=None, executor=None):
+        """Converte o texto e devolve o .docx em um BytesIO
 
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+        Com o backend 'stream' e um executor de processos, documentos grandes são montados em pedaços paralelos.
+        """
+        backend = backend or DOCX_BACKEND
+        if backend == 'stream':
+            doc_bytes = io.BytesIO()
+            self._write_stream(markdown_text, doc_bytes, executor)
+            doc_bytes.seek(0)
+            return doc_bytes
+        if backend != 'python-docx':
+            raise ValueError(f"Backend de escrita desconhecido: {backend}")
 
-            # Remove asteriscos duplicados do markdown
-            line = re.sub(r'\*\*(.*?)\*\*', r'\1', line)
-
-            # Título principal (primeira linha em maiúsculas longa)
-            if line.isupper() and len(line) > 10:
-                para = doc.add_paragraph()
-                run = para.add_run(line)
-                run.bold = True
-                para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-                para.space_after = Pt(12)
-                continue
-
-            # Campos com dois pontos (ex: "NOME DO PARTICIPANTE:")
-            if ':' in line and not line.startswith('-') and not line.startswith('•'):
-                parts = line.split(':', 1)
-                para = doc.add_paragraph()
-                run = para.add_run(parts[0].strip() + ':')
-                run.bold = True
-                if len(parts) > 1 and parts[1].strip():
-                    para.add_run(' ' + parts[1].strip())
-                para.space_after = Pt(6)
-                continue
-
-            # Seções principais (ex: "FONOAUDIOLOGIA")
-            if line.isupper() and not ':' in line:
-                current_section = line
-                para = doc.add_paragraph()
-                run = para.add_run(line)
-                run.bold = True
-                para.space_before = Pt(12)
-                para.space_after = Pt(6)
-                continue
-
-            # Lista com marcadores
-            if line.startswith('-') or line.startswith('•'):
-                text = line.lstrip('-• ').strip()
-                if not text:
-                    continue  # pula marcadores vazios
-                para = doc.add_paragraph()
-                para.style = 'List Bullet'
-                # Negrito para itens especiais
-                if text.lower().startswith(('metas terapêuticas', 'objetivos terapêuticos', 'observações')):
-                    parts = text.split(':', 1)
-                    run = para.add_run(parts[0] + ':')
-                    run.bold = True
-                    if len(parts) > 1:
-                        para.add_run(parts[1])
-                else:
-                    para.add_run(text)
-                para.space_after = Pt(2)
-                continue
-
-            # Observações ou texto normal
-            para = doc.add_paragraph()
-            if current_section and 'OBSERVAÇÕES' in current_section.upper():
-                para.paragraph_format.left_indent = Pt(20)
-            para.add_run(line)
-            para.space_after = Pt(2)
+        doc = self.build_document(markdown_text)
 
         # Salva em bytes para uso com Flask send_file
         doc_bytes = io.BytesIO()
@@ -119,59 +195,32 @@ class MarkdownToDocxConverter:
         doc_bytes.seek(0)
         return doc_bytes
 
-    def process_inline_formatting(paragraph, text):
-        """Processa formatação inline como negrito e itálico"""
-        # Encontra todos os padrões de formatação
-        parts = []
-        current_pos = 0
-        
-        # Padrão para negrito: **texto**
-        bold_pattern = re.compile(r'\*\*(.*?)\*\*')
-        # Padrão para itálico: *texto* ou _texto_
-        italic_pattern = re.compile(r'(\*|_)(.*?)(\*|_)')
-        
-        # Mescla os padrões com posição para processamento
-        formats = []
-        
-        # Encontra negrito
-        for match in bold_pattern.finditer(text):
-            formats.append((match.start(), match.end(), match.group(1), 'bold'))
-        
-        # Encontra itálico
-        for match in italic_pattern.finditer(text):
-            # Evita processar ** novamente (já tratado como negrito)
-            if not (match.group(1) == '*' and match.group(3) == '*' and 
-                    match.start() > 0 and text[match.start()-1] == '*' and 
-                    match.end() < len(text) and text[match.end()] == '*'):
-                formats.append((match.start(), match.end(), match.group(2), 'italic'))
-        
-        # Ordena por posição inicial
-        formats.sort(key=lambda x: x[0])
-        
-        # Se não houver formatação, adicione o texto inteiro
-        if not formats:
-            paragraph.add_run(text)
+    def save_markdown_as_docx(self, markdown_text, output_path, drive_id=None, backend=None, executor=None):
+        """Converte e grava o .docx em output_path; com o backend 'stream' grava direto no arquivo"""
+        if (backend or DOCX_BACKEND) == 'stream':
+            self._write_stream(markdown_text, output_path, executor)
             return
-        
-        # Processa o texto com as formatações
-        last_end = 0
-        for start, end, content, format_type in formats:
-            # Adiciona texto não formatado antes do formato atual
-            if start > last_end:
-                paragraph.add_run(text[last_end:start])
-            
-            # Adiciona o texto formatado
-            run = paragraph.add_run(content)
-            if format_type == 'bold':
+        doc_bytes = self.parse_markdown_to_docx(markdown_text, output_path, drive_id, backend)
+        with open(output_path, 'wb') as f:
+            f.write(doc_bytes.read())
+
+    @staticmethod
+    def _write_stream(markdown_text, output, executor=None):
+        from docx_stream_writer import write_docx_stream, write_docx_parallel
+        if executor is not None:
+            write_docx_parallel(markdown_text, output, executor)
+        else:
+            write_docx_stream(classify_lines(markdown_text), output)
+
+    @staticmethod
+    def process_inline_formatting(paragraph, text):
+        """Adiciona o texto ao parágrafo com **negrito**, *itálico* e _itálico_ aplicados como runs"""
+        for segment in tokenize_inline(text):
+            run = paragraph.add_run(segment.text)
+            if segment.bold:
                 run.bold = True
-            elif format_type == 'italic':
+            if segment.italic:
                 run.italic = True
-            
-            last_end = end
-        
-        # Adiciona qualquer texto restante após o último formato
-        if last_end < len(text):
-            paragraph.add_run(text[last_end:])
 
     @staticmethod
     def show_usage_and_exit():
@@ -184,6 +233,8 @@ class MarkdownToDocxConverter:
         print("Exemplos:")
         print("  python markdown_to_docx.py documento.docx documento_formatado.docx")
         print("  python markdown_to_docx.py documento.docx documento_formatado.docx --drive-id 1abc123\n")
+        print("Para converter pastas inteiras em paralelo:")
+        print("  python batch_convert.py pasta_entrada --output-dir pasta_saida --workers 8\n")
         print("Para assistência interativa, execute:")
         print("  converter_markdown.bat\n")
         sys.exit(1)
@@ -195,6 +246,10 @@ class MarkdownToDocxConverter:
         parser.add_argument('output_file', help='Caminho para salvar o arquivo .docx formatado')
         parser.add_argument('--drive-id', '-d', help='ID opcional do Google Drive para incluir no documento')
         parser.add_argument('--google-doc', '-g', action='store_true', help='Indica que o input é um ID do Google Drive')
+        parser.add_argument('--backend', choices=DOCX_BACKENDS, default=DOCX_BACKEND,
+                            help='Backend de escrita do .docx (stream usa memória constante em documentos grandes)')
+        parser.add_argument('--workers', '-w', type=int, default=1,
+                            help='Processos para montar em paralelo documentos grandes (backend stream)')
 
         if len(sys.argv) == 1:
             MarkdownToDocxConverter.show_usage_and_exit()
@@ -224,10 +279,13 @@ class MarkdownToDocxConverter:
                     return 1
                 markdown_text = converter.extract_text_from_docx(args.input_file)
             
-            doc_bytes = converter.parse_markdown_to_docx(markdown_text, args.output_file, args.drive_id)
             # Salva o arquivo de saída
-            with open(args.output_file, 'wb') as f:
-                f.write(doc_bytes.read())
+            if args.workers > 1 and args.backend == 'stream':
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                    converter.save_markdown_as_docx(markdown_text, args.output_file, args.drive_id, args.backend, executor)
+            else:
+                converter.save_markdown_as_docx(markdown_text, args.output_file, args.drive_id, args.backend)
             
             print(f"\nConversão concluída com sucesso!")
             print(f"Documento formatado salvo em: {args.output_file}")
@@ -0,0 +1,224 @@
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Limites dos histogramas de duração, em segundos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Spans do trace em andamento no contexto atual (None fora de um trace)
+_current_spans = contextvars.ContextVar('converter_spans', default=None)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monotônico com rótulos"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f'{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram:
+    """Histograma cumulativo no formato do Prometheus"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {count}'
+
+
+class CallbackGauge:
+    """Gauge lido na hora da coleta a partir de uma função que devolve {rótulos: valor}"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames, callback):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"metrics: Falha ao coletar {self.name}: {e}")
+            return
+        for key, value in sorted(values.items()):
+            if value is None:
+                continue
+            key = key if isinstance(key, tuple) else (key,)
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """Texto no formato de exposição do Prometheus (0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'converter_stage_duration_seconds', 'Duração de cada etapa da conversão', ('stage',)))
+STAGE_ERRORS = registry.register(Counter(
+    'converter_stage_errors', 'Falhas por etapa da conversão', ('stage',)))
+FILES = registry.register(Counter(
+    'converter_files', 'Arquivos processados por tipo de job e resultado', ('kind', 'status')))
+BYTES = registry.register(Counter(
+    'converter_bytes', 'Bytes transferidos com o Drive', ('direction',)))
+HTTP_REQUESTS = registry.register(Counter(
+    'converter_http_requests', 'Requisições HTTP atendidas', ('endpoint', 'method', 'status')))
+HTTP_SECONDS = registry.register(Histogram(
+    'converter_http_request_duration_seconds', 'Duração das requisições HTTP', ('endpoint',)))
+
+
+def register_gauge(name, help, labelnames, callback):
+    """Registra um gauge calculado na coleta (ex: estatísticas do cache)"""
+    return registry.register(CallbackGauge(name, help, labelnames, callback))
+
+
+def record_span(stage, seconds, error=None):
+    """Registra a duração de uma etapa no histograma e no trace em andamento"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if error is not None:
+        STAGE_ERRORS.inc(stage=stage)
+    spans = _current_spans.get()
+    if spans is not None:
+        entry = {'stage': stage, 'ms': round(seconds * 1000, 2)}
+        if error is not None:
+            entry['error'] = error if isinstance(error, str) else type(error).__name__
+        spans.append(entry)
+
+
+def record_spans(spans):
+    """Registra spans medidos em outro processo (ex: conversão no pool de processos)"""
+    for entry in spans:
+        record_span(entry['stage'], entry['ms'] / 1000, entry.get('error'))
+
+
+@contextmanager
+def span(stage):
+    """Mede uma etapa; exceções são contadas como erro da etapa e repassadas"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        record_span(stage, time.perf_counter() - started, e)
+        raise
+    record_span(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def collect_spans():
+    """Coleta os spans do bloco numa lista, sem registrar log (usado nos processos de conversão)"""
+    spans = []
+    token = _current_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_spans.reset(token)
+
+
+@contextmanager
+def trace(name, **fields):
+    """Trace de uma requisição: ao final, registra uma linha JSON com as etapas e a duração total
+
+    Devolve o registro do trace; quem trata o erro por conta própria pode marcar record['status'] = 'error'.
+    """
+    started = time.perf_counter()
+    record = {'trace': name, 'status': 'ok'}
+    record.update(fields)
+    with collect_spans() as spans:
+        try:
+            yield record
+        except BaseException:
+            record['status'] = 'error'
+            raise
+        finally:
+            record['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            record['spans'] = spans
+            print(f"metrics: {json.dumps(record, ensure_ascii=False)}")
+
+
+def render():
+    return registry.render()
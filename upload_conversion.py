@@ -0,0 +1,155 @@
+import io
+import os
+import shutil
+import zipfile
+import tempfile
+from collections import deque
+
+from folder_pipeline import convert_docx_bytes, convert_text_bytes, get_process_pool, MAX_IN_FLIGHT
+from conversion_cache import get_conversion_cache, key_for_content
+from google_drive_integration import DOCX_MIME_TYPE
+from metrics import record_spans, FILES
+
+MARKDOWN_EXTENSIONS = ('.md', '.markdown', '.txt')
+# Arquivos enviados acima deste tamanho esperam a conversão em disco, não em memória
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', 1024 * 1024))
+
+
+def input_kind(filename, content_type, data):
+    """'docx' ou 'markdown', pela extensão, pelo Content-Type ou, sem eles, pelo conteúdo"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.docx':
+        return 'docx'
+    if extension in MARKDOWN_EXTENSIONS:
+        return 'markdown'
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type == DOCX_MIME_TYPE:
+        return 'docx'
+    if content_type.startswith('text/'):
+        return 'markdown'
+    # .docx é um zip
+    return 'docx' if data[:2] == b'PK' else 'markdown'
+
+
+def read_uploads(request):
+    """Arquivos enviados em multipart (qualquer campo) ou, sem eles, o corpo da requisição como um arquivo
+
+    Cada arquivo do multipart é copiado para um arquivo temporário próprio (em disco acima de
+    UPLOAD_SPOOL_BYTES) e só vai inteiro para a memória ao entrar na conversão, no máximo MAX_IN_FLIGHT de
+    cada vez; os arquivos da requisição são fechados pelo Flask antes do fim do zip em streaming. O corpo
+    sem multipart é lido inteiro. Em ambos os casos MAX_UPLOAD_BYTES limita o tamanho da requisição.
+    """
+    uploads = []
+    for _, storage in request.files.items(multi=True):
+        spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+        shutil.copyfileobj(storage.stream, spooled)
+        spooled.seek(0)
+        # Os dois primeiros bytes bastam para saber se o arquivo está vazio e para reconhecer um .docx
+        head = spooled.read(2)
+        spooled.seek(0)
+        if not head:
+            spooled.close()
+            continue
+        uploads.append({
+            'name': os.path.basename(storage.filename or 'documento'),
+            'kind': input_kind(storage.filename, storage.mimetype, head),
+            'file': spooled,
+        })
+    if not uploads and not request.form:
+        data = request.get_data()
+        if data:
+            name = os.path.basename(request.args.get('name') or 'documento')
+            uploads.append({'name': name, 'kind': input_kind(name, request.content_type, data), 'file': io.BytesIO(data)})
+    return uploads
+
+
+def converted_name(name):
+    return f"{os.path.splitext(name)[0]}_formatado.docx"
+
+
+def convert_uploads(uploads, max_in_flight=None):
+    """Converte os uploads no pool de processos e gera (upload, bytes do .docx, erro) na ordem de envio
+
+    No máximo max_in_flight conversões ficam pendentes, para que um lote grande não acumule resultados em memória.
+    """
+    max_in_flight = max_in_flight or MAX_IN_FLIGHT
+    cache = get_conversion_cache()
+    pool = get_process_pool()
+    pending = deque()
+    uploads = iter(uploads)
+
+    def submit(upload):
+        with upload['file'] as f:
+            data = f.read()
+        key = key_for_content(data)
+        doc_data = cache.get(key)
+        if doc_data is not None:
+            return upload, key, doc_data
+        func = convert_docx_bytes if upload['kind'] == 'docx' else convert_text_bytes
+        return upload, key, pool.submit(func, data)
+
+    while True:
+        while len(pending) < max_in_flight:
+            upload = next(uploads, None)
+            if upload is None:
+                break
+            pending.append(submit(upload))
+        if not pending:
+            return
+        upload, key, result = pending.popleft()
+        error = None
+        if isinstance(result, bytes):
+            doc_data = result
+        else:
+            try:
+                doc_data, spans = result.result()
+                record_spans(spans)
+                cache.put(key, doc_data)
+            except Exception as e:
+                print(f"upload_conversion: Falha ao converter {upload['name']}: {e}")
+                doc_data, error = None, str(e)
+        FILES.inc(kind='upload', status='error' if error else 'ok')
+        yield upload, doc_data, error
+
+
+class _ZipSink(io.RawIOBase):
+    """Destino não pesquisável do zip: os bytes gravados são entregues em pedaços pelo gerador"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(uploads):
+    """Gera o zip dos documentos convertidos à medida que ficam prontos; falhas são listadas em ERROS.txt"""
+    sink = _ZipSink()
+    names = set()
+    errors = []
+    # .docx já é comprimido: as entradas vão sem nova compressão
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        for upload, doc_data, error in convert_uploads(uploads):
+            if error:
+                errors.append(f"{upload['name']}: {error}")
+                continue
+            name = converted_name(upload['name'])
+            stem, counter = name[:-len('.docx')], 2
+            while name in names:
+                name = f"{stem} ({counter}).docx"
+                counter += 1
+            names.add(name)
+            archive.writestr(name, doc_data)
+            yield sink.drain()
+        if errors:
+            archive.writestr('ERROS.txt', '\n'.join(errors) + '\n', zipfile.ZIP_DEFLATED)
+    yield sink.drain()